@@ -0,0 +1,4 @@
+import time
+
+# when the first module of the package was imported, see `STARTUP_SECONDS`
+IMPORT_STARTED = time.perf_counter()
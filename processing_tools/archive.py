@@ -0,0 +1,342 @@
+"""
+Conversion of the files in a zip archive, see `convert_members`.
+
+Members are streamed from the archive into scratch space one at a time, right
+before they are converted, so neither memory nor scratch space has to hold the
+whole archive's contents. The member count and uncompressed size are checked
+against limits before anything is extracted.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import (
+    Callable,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypedDict,
+)
+
+from starlette.concurrency import run_in_threadpool
+
+from processing_tools.logging.config import get_doc_processing_log_extra
+from processing_tools.metrics import INPUT_FORMATS
+from processing_tools.pdf import DamagedPDFError, check_pdf
+from processing_tools.pipeline import PrefetchPool
+from processing_tools.sniff import UnsupportedFormatError, sniff_format
+from processing_tools.types import DocumentMeta, Endpoint, FileConverter
+from processing_tools.utils import get_extension
+from processing_tools.workspace import (
+    JobOutput,
+    ScratchReservation,
+    job_input_path,
+    new_job_id,
+    remove_job_files,
+)
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_NAME = "manifest.json"
+# the manifest of a merged PDF is returned in this header, without its members
+# once it is longer than proxies commonly accept in a header
+MANIFEST_HEADER = "x-archive-manifest"
+MANIFEST_HEADER_MAX_BYTES = 4096
+# directories some archivers add next to the files, e.g. resource forks on macOS
+METADATA_PREFIXES = ("__MACOSX/",)
+EXTRACT_CHUNK_BYTES = 1024 * 1024
+
+
+class ArchiveLimitError(Exception):
+    """
+    The archive has more members or more uncompressed bytes than allowed.
+    """
+
+
+class NoMembersConvertedError(Exception):
+    """
+    None of the members of the archive could be converted.
+    """
+
+    def __init__(self, members: List["MemberResult"]):
+        super().__init__(f"none of the {len(members)} files could be converted")
+        self.members = members
+
+
+class MemberResult(TypedDict):
+    """
+    The outcome of converting one member, as reported in the manifest. `output`
+    is the name of its converted file in a zip output.
+    """
+
+    name: str
+    format: Optional[str]
+    size_bytes: int
+    status: Literal["ok", "error"]
+    error: Optional[str]
+    output: Optional[str]
+    extract_time: float
+    convert_time: float
+
+
+ConvertedMember = Tuple[MemberResult, Optional[Path]]
+
+
+class ArchiveOutput(JobOutput):
+    """
+    The combined output of an archive, with the results of its members.
+    """
+
+    def __init__(
+        self, scratch: ScratchReservation, path: Path, members: List[MemberResult]
+    ):
+        super().__init__(scratch, path)
+        self.members = members
+
+
+def _is_metadata(name: str) -> bool:
+    return name.startswith(METADATA_PREFIXES) or os.path.basename(name).startswith(".")
+
+
+def list_members(
+    path: Path, max_members: int, max_uncompressed_bytes: int
+) -> List[zipfile.ZipInfo]:
+    """
+    The files in the zip archive at `path`, in archive order, leaving out
+    directories and metadata of archivers.
+
+    Raises `ArchiveLimitError` when there are more than `max_members` of them or
+    they add up to more than `max_uncompressed_bytes` according to the
+    archive's directory; `extract_member` enforces the sizes listed there.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            members = [
+                info
+                for info in archive.infolist()
+                if not info.is_dir() and not _is_metadata(info.filename)
+            ]
+    except zipfile.BadZipFile:
+        raise UnsupportedFormatError(None)
+
+    if len(members) > max_members:
+        raise ArchiveLimitError(
+            f"archive has {len(members)} files, at most {max_members} are allowed"
+        )
+    uncompressed_bytes = sum(info.file_size for info in members)
+    if uncompressed_bytes > max_uncompressed_bytes:
+        raise ArchiveLimitError(
+            f"archive expands to {uncompressed_bytes} bytes, "
+            f"at most {max_uncompressed_bytes} are allowed"
+        )
+    return members
+
+
+def extract_member(archive_path: Path, info: zipfile.ZipInfo, out_path: Path) -> int:
+    """
+    Stream the member `info` of the archive at `archive_path` to `out_path`.
+
+    Raises `ArchiveLimitError` when it expands beyond the size the archive's
+    directory lists for it. Returns the number of bytes written.
+    """
+    written = 0
+    with zipfile.ZipFile(archive_path) as archive, archive.open(info) as member:
+        with open(out_path, "wb") as f:
+            while chunk := member.read(EXTRACT_CHUNK_BYTES):
+                written += len(chunk)
+                if written > info.file_size:
+                    raise ArchiveLimitError(
+                        f"{info.filename} expands beyond its listed size"
+                    )
+                f.write(chunk)
+    return written
+
+
+def _error_message(error: Exception) -> str:
+    # the messages of other errors contain paths in scratch space
+    if isinstance(error, (UnsupportedFormatError, ArchiveLimitError, DamagedPDFError)):
+        return str(error)
+    return "conversion failed"
+
+
+async def _convert_member(
+    endpoint: Endpoint,
+    meta: Optional[DocumentMeta],
+    archive_path: Path,
+    info: zipfile.ZipInfo,
+    work_dir: Path,
+    converter: FileConverter,
+    finish: Optional[Callable[[Path], Path]],
+) -> ConvertedMember:
+    result: MemberResult = {
+        "name": info.filename,
+        "format": None,
+        "size_bytes": info.file_size,
+        "status": "ok",
+        "error": None,
+        "output": None,
+        "extract_time": 0.0,
+        "convert_time": 0.0,
+    }
+    extension = get_extension(info.filename)
+    in_path = job_input_path(work_dir, new_job_id(), extension)
+    out_path: Optional[Path] = None
+    t_start = time.perf_counter()
+    try:
+        await run_in_threadpool(extract_member, archive_path, info, in_path)
+        t_extracted = time.perf_counter()
+        result["extract_time"] = t_extracted - t_start
+
+        file_format = await run_in_threadpool(sniff_format, in_path, extension)
+        result["format"] = file_format
+        if file_format == converter.output_extension:
+            INPUT_FORMATS.labels(endpoint, file_format, "passthrough").inc()
+            if file_format == "pdf":
+                # a damaged PDF would fail merging the outputs of all members
+                await run_in_threadpool(check_pdf, in_path)
+            out_path = converter.output_path(in_path)
+            os.makedirs(out_path.parent, exist_ok=True)
+            os.replace(in_path, out_path)
+        elif file_format in converter.input_formats:
+            INPUT_FORMATS.labels(endpoint, file_format, "convert").inc()
+            if file_format != extension:
+                # libreoffice picks its import filter by extension
+                sniffed_path = in_path.with_suffix(f".{file_format}")
+                os.replace(in_path, sniffed_path)
+                in_path = sniffed_path
+            out_path = converter.output_path(in_path)
+            await converter.convert(in_path)
+        else:
+            INPUT_FORMATS.labels(endpoint, file_format or "unknown", "reject").inc()
+            raise UnsupportedFormatError(file_format)
+
+        if finish:
+            out_path = await run_in_threadpool(finish, out_path)
+        result["convert_time"] = time.perf_counter() - t_extracted
+
+    except Exception as e:
+        # a broken member doesn't fail the others, it is reported in the manifest
+        extra = get_doc_processing_log_extra(endpoint, meta)
+        extra["file_extension"] = extension
+        extra["file_format"] = result["format"] or "unknown"
+        extra["error_detail"] = str(e)
+        logger.warning("%s: converting a member failed", endpoint, extra=extra)
+        result["status"] = "error"
+        result["error"] = _error_message(e)
+        remove_job_files(out_path)
+        out_path = None
+    finally:
+        remove_job_files(in_path)
+
+    return result, out_path
+
+
+async def convert_members(
+    endpoint: Endpoint,
+    meta: Optional[DocumentMeta],
+    archive_path: Path,
+    members: Sequence[zipfile.ZipInfo],
+    work_dir: Path,
+    converter: FileConverter,
+    concurrency: int,
+    prefetch_pool: PrefetchPool,
+    finish: Optional[Callable[[Path], Path]] = None,
+) -> List[ConvertedMember]:
+    """
+    Extract and convert `members` of the archive at `archive_path` with
+    `converter`, `concurrency` at a time, then pass their outputs to `finish`.
+
+    Each member takes a slot and its size in `prefetch_pool` like any other
+    job of the converter, so an archive queues with single files instead of
+    getting ahead of them.
+
+    Returns the result and output path of each member, in archive order. The
+    output path is None for members that failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def convert(info: zipfile.ZipInfo) -> ConvertedMember:
+        async with semaphore, prefetch_pool.slot() as prefetch:
+            await prefetch.reserve(info.file_size)
+            return await _convert_member(
+                endpoint, meta, archive_path, info, work_dir, converter, finish
+            )
+
+    return list(await asyncio.gather(*map(convert, members)))
+
+
+def _output_name(name: str, extension: str, taken: Set[str]) -> str:
+    """
+    >>> _output_name("../reports/q1.docx", "pdf", {"reports/q1.pdf"})
+    'reports/q1-2.pdf'
+    """
+    # keep the folders of the archive, but nothing that escapes it
+    parts = [
+        part
+        for part in name.replace("\\", "/").split("/")
+        if part not in ("", ".", "..")
+    ]
+    stem = os.path.splitext("/".join(parts))[0] or "file"
+    output = f"{stem}.{extension}"
+    n = 2
+    while output in taken:
+        output = f"{stem}-{n}.{extension}"
+        n += 1
+    taken.add(output)
+    return output
+
+
+def manifest(members: Sequence[MemberResult]) -> dict:
+    return {
+        "converted": sum(member["status"] == "ok" for member in members),
+        "failed": sum(member["status"] == "error" for member in members),
+        "members": list(members),
+    }
+
+
+def manifest_header(members: Sequence[MemberResult]) -> str:
+    """
+    The manifest of `members` as compact JSON for `MANIFEST_HEADER`. When it
+    doesn't fit in `MANIFEST_HEADER_MAX_BYTES`, only the counts are kept and
+    `truncated` is set.
+
+    >>> manifest_header([])
+    '{"converted":0,"failed":0,"members":[]}'
+    """
+    full = json.dumps(manifest(members), separators=(",", ":"))
+    if len(full) <= MANIFEST_HEADER_MAX_BYTES:
+        return full
+    counts = manifest(members)
+    del counts["members"]
+    counts["truncated"] = True
+    return json.dumps(counts, separators=(",", ":"))
+
+
+def write_zip(
+    members: Sequence[ConvertedMember], extension: str, out_path: Path
+) -> None:
+    """
+    Write the outputs of `members` and a manifest of all of them to a zip
+    archive at `out_path`, setting the `output` name of each converted member.
+
+    Outputs are stored as they are, compressing PDFs again gains little.
+    """
+    taken = {MANIFEST_NAME}
+    os.makedirs(out_path.parent, exist_ok=True)
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_STORED) as archive:
+        for result, path in members:
+            if path is None:
+                continue
+            result["output"] = _output_name(result["name"], extension, taken)
+            archive.write(path, result["output"])
+        archive.writestr(
+            MANIFEST_NAME,
+            json.dumps(manifest([result for result, _ in members]), indent=2),
+        )
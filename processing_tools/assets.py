@@ -0,0 +1,502 @@
+"""
+A local cache for the assets (stylesheets, fonts, images, ...) of rendered pages.
+
+Before a page is rendered, the asset urls in its HTML are rewritten to point at
+this service's `/asset-cache/` endpoint, which serves them from an on-disk cache
+and only goes to the origin on a miss. Stylesheets are rewritten the same way
+when they are served, so fonts and images they reference are cached too.
+
+Proxied urls carry a signature, so the endpoint only fetches urls that were
+found in a page we rendered and can't be used as an open proxy.
+"""
+import base64
+import binascii
+import email.utils
+import hashlib
+import hmac
+import html
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Mapping, Match, Optional, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from processing_tools.metrics import ASSET_CACHE_BYTES, ASSET_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+# pages are rewritten as text, but written back byte for byte in whatever
+# encoding they use
+HTML_ENCODING = "utf-8"
+HTML_ERRORS = "surrogateescape"
+
+# assets are downloaded and served in chunks of this size
+ASSET_CHUNK_BYTES = 64 * 1024
+
+ASSET_TAG_RE = re.compile(
+    r"<(?:img|script|link|source|input|video|audio|embed|track|image)\b[^>]*>",
+    re.IGNORECASE,
+)
+ASSET_ATTRIBUTE_RE = re.compile(
+    r"""(?P<prefix>\s(?P<name>src|href|poster|srcset|xlink:href)\s*=\s*)"""
+    r"""(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)'|(?P<bare>[^\s"'>]+))""",
+    re.IGNORECASE,
+)
+CSS_URL_RE = re.compile(
+    r"""url\(\s*(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)'|(?P<bare>[^)\s]*))\s*\)""",
+    re.IGNORECASE,
+)
+CSS_IMPORT_RE = re.compile(
+    r"""@import\s+(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)')""", re.IGNORECASE
+)
+BASE_TAG_RE = re.compile(
+    r"""<base\b[^>]*\bhref\s*=\s*(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)'|(?P<bare>[^\s"'>]+))""",
+    re.IGNORECASE,
+)
+HEAD_TAG_RE = re.compile(r"<head\b[^>]*>", re.IGNORECASE)
+# CSS in pages is only rewritten where it applies, not in text or scripts
+STYLE_ELEMENT_RE = re.compile(
+    r"(?P<open><style\b[^>]*>)(?P<css>.*?)(?P<close></style\s*>)",
+    re.IGNORECASE | re.DOTALL,
+)
+TAG_RE = re.compile(r"<[a-zA-Z][^>]*>")
+STYLE_ATTRIBUTE_RE = re.compile(
+    r"""(?P<prefix>\sstyle\s*=\s*)(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)')""",
+    re.IGNORECASE,
+)
+
+
+def _quoted_value(match: Match) -> str:
+    groups = match.groupdict()
+    return next(
+        groups[name]
+        for name in ("double", "single", "bare")
+        if groups.get(name) is not None
+    )
+
+
+class AssetProxy:
+    """
+    Builds and checks the signed `/asset-cache/` urls for `base_url`, the address
+    of this service as seen by the renderer.
+    """
+
+    def __init__(self, base_url: str, secret: str):
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret.encode()
+
+    def sign(self, origin_url: str) -> str:
+        digest = hmac.new(self.secret, origin_url.encode(), hashlib.sha256)
+        return digest.hexdigest()[:32]
+
+    def url_for(self, origin_url: str) -> str:
+        encoded = base64.urlsafe_b64encode(
+            origin_url.encode(HTML_ENCODING, HTML_ERRORS)
+        ).decode()
+        return f"{self.base_url}/asset-cache/{encoded}.{self.sign(origin_url)}"
+
+    def origin_url(self, token: str) -> Optional[str]:
+        """
+        The origin url of a token built by `url_for`, or None if its signature
+        doesn't match.
+        """
+        encoded, _, signature = token.rpartition(".")
+        try:
+            origin_url = base64.urlsafe_b64decode(encoded).decode(
+                HTML_ENCODING, "replace"
+            )
+        except (binascii.Error, ValueError):
+            return None
+        if not hmac.compare_digest(signature, self.sign(origin_url)):
+            return None
+        return origin_url
+
+    def _proxied(self, url: str, base_url: str) -> str:
+        url = html.unescape(url.strip())
+        if not url or url.startswith(("#", "data:", "blob:", "javascript:")):
+            return url
+        absolute = urljoin(base_url, url)
+        if urlsplit(absolute).scheme not in ("http", "https"):
+            return url
+        return self.url_for(absolute)
+
+    def _rewrite_css_urls(self, css: str, base_url: str) -> str:
+        def url(match: Match) -> str:
+            return f'url("{self._proxied(_quoted_value(match), base_url)}")'
+
+        def import_(match: Match) -> str:
+            return f'@import "{self._proxied(_quoted_value(match), base_url)}"'
+
+        css = CSS_IMPORT_RE.sub(import_, css)
+        return CSS_URL_RE.sub(url, css)
+
+    def rewrite_css(self, css: str, css_url: str) -> str:
+        """
+        Point the `url()`s and `@import`s of the stylesheet at `css_url` at the
+        asset cache.
+        """
+        return self._rewrite_css_urls(css, css_url)
+
+    def rewrite_html(self, page: str, page_url: str) -> str:
+        """
+        Point the assets of the page at `page_url` at the asset cache.
+
+        Links (`<a href>`) are left alone, as are `url()`s outside of `<style>`
+        elements and `style` attributes. A `<base>` tag is added if the page has
+        none, so anything left relative still resolves against the origin.
+        """
+        base_match = BASE_TAG_RE.search(page)
+        base_url = (
+            urljoin(page_url, html.unescape(_quoted_value(base_match)))
+            if base_match
+            else page_url
+        )
+
+        def attribute(match: Match) -> str:
+            value = _quoted_value(match)
+            if match.group("name").lower() == "srcset":
+                candidates = []
+                for candidate in value.split(","):
+                    parts = candidate.strip().split(None, 1)
+                    if parts:
+                        parts[0] = self._proxied(parts[0], base_url)
+                    candidates.append(" ".join(parts))
+                value = ", ".join(candidates)
+            else:
+                value = self._proxied(value, base_url)
+            return f'{match.group("prefix")}"{html.escape(value)}"'
+
+        def tag(match: Match) -> str:
+            return ASSET_ATTRIBUTE_RE.sub(attribute, match.group(0))
+
+        def style_element(match: Match) -> str:
+            css = self._rewrite_css_urls(match.group("css"), base_url)
+            return f'{match.group("open")}{css}{match.group("close")}'
+
+        def style_attribute(match: Match) -> str:
+            css = self._rewrite_css_urls(html.unescape(_quoted_value(match)), base_url)
+            return f'{match.group("prefix")}"{html.escape(css)}"'
+
+        def styled_tag(match: Match) -> str:
+            return STYLE_ATTRIBUTE_RE.sub(style_attribute, match.group(0))
+
+        page = ASSET_TAG_RE.sub(tag, page)
+        page = STYLE_ELEMENT_RE.sub(style_element, page)
+        page = TAG_RE.sub(styled_tag, page)
+
+        if not base_match:
+            base_tag = f'<base href="{html.escape(page_url)}">'
+            head_match = HEAD_TAG_RE.search(page)
+            if head_match:
+                page = page[: head_match.end()] + base_tag + page[head_match.end() :]
+            else:
+                page = base_tag + page
+        return page
+
+    def rewrite_html_file(self, path: Union[str, Path], page_url: str) -> None:
+        with open(path, encoding=HTML_ENCODING, errors=HTML_ERRORS, newline="") as f:
+            page = f.read()
+        page = self.rewrite_html(page, page_url)
+        with open(
+            path, "w", encoding=HTML_ENCODING, errors=HTML_ERRORS, newline=""
+        ) as f:
+            f.write(page)
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return float(email.utils.mktime_tz(parsed))
+
+
+def freshness_lifetime(
+    headers: Mapping[str, str], default_ttl: float, now: Optional[float] = None
+) -> Optional[float]:
+    """
+    How many seconds a response with `headers` may be served from the cache, or
+    None if it must not be stored.
+
+    >>> freshness_lifetime({"Cache-Control": "public, max-age=600"}, 60)
+    600.0
+    >>> freshness_lifetime({"Cache-Control": "no-store"}, 60) is None
+    True
+    >>> freshness_lifetime({"Cache-Control": "no-cache"}, 60)
+    0.0
+    >>> freshness_lifetime({}, 60)
+    60.0
+    """
+    now = time.time() if now is None else now
+    directives = {}
+    for directive in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    if "max-age" in directives:
+        try:
+            return max(float(directives["max-age"]), 0.0)
+        except ValueError:
+            return 0.0
+
+    expires = _parse_http_date(headers.get("Expires"))
+    if headers.get("Expires") is not None:
+        date = _parse_http_date(headers.get("Date")) or now
+        return max(expires - date, 0.0) if expires is not None else 0.0
+
+    last_modified = _parse_http_date(headers.get("Last-Modified"))
+    if last_modified is not None:
+        # heuristic freshness, see RFC 9111 section 4.2.2
+        return min(max((now - last_modified) / 10, 0.0), default_ttl * 24)
+    return float(default_ttl)
+
+
+class CachedAsset:
+    def __init__(self, path: Path, meta: dict):
+        self.path = path
+        self.meta = meta
+
+    @property
+    def content_type(self) -> str:
+        return self.meta.get("content_type") or "application/octet-stream"
+
+    @property
+    def fresh(self) -> bool:
+        return self.meta["expires_at"] > time.time()
+
+
+class AssetCache:
+    """
+    An on-disk cache of assets, evicting the least recently used assets once it
+    holds more than `max_bytes`. Thread safe; assets are fetched from the origin
+    with `requests`, so the cache is meant to be used from sync endpoints.
+    """
+
+    def __init__(
+        self,
+        dir: Union[str, Path],
+        max_bytes: int,
+        max_asset_bytes: int,
+        default_ttl: float,
+        timeout: float,
+    ):
+        self.dir = Path(dir)
+        self.max_bytes = max_bytes
+        self.max_asset_bytes = max_asset_bytes
+        self.default_ttl = default_ttl
+        self.timeout = timeout
+        self.bytes = 0
+        # key -> size, least recently used first
+        self.index: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _paths(self, key: str) -> Tuple[Path, Path]:
+        return self.dir / f"{key}.body", self.dir / f"{key}.json"
+
+    def _load(self) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        entries = []
+        for meta_path in self.dir.glob("*.json"):
+            body_path = meta_path.with_suffix(".body")
+            try:
+                entries.append(
+                    (
+                        os.path.getatime(meta_path),
+                        meta_path.stem,
+                        os.path.getsize(body_path),
+                    )
+                )
+            except FileNotFoundError:
+                meta_path.unlink(missing_ok=True)
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.bytes += size
+        ASSET_CACHE_BYTES.set(self.bytes)
+
+    def _get(self, key: str) -> Optional[CachedAsset]:
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._lock:
+            if key in self.index:
+                self.index.move_to_end(key)
+        # the access time orders the index when it is loaded again
+        os.utime(meta_path)
+        return CachedAsset(body_path, meta)
+
+    def _store(self, key: str, body_path: Path, meta: dict) -> CachedAsset:
+        final_body_path, meta_path = self._paths(key)
+        size = os.path.getsize(body_path)
+        os.replace(body_path, final_body_path)
+        self._write_meta(meta_path, meta)
+
+        with self._lock:
+            self.bytes += size - self.index.pop(key, 0)
+            self.index[key] = size
+            evicted = []
+            while self.bytes > self.max_bytes and len(self.index) > 1:
+                evicted_key, evicted_size = self.index.popitem(last=False)
+                self.bytes -= evicted_size
+                evicted.append(evicted_key)
+            ASSET_CACHE_BYTES.set(self.bytes)
+
+        for evicted_key in evicted:
+            for path in self._paths(evicted_key):
+                path.unlink(missing_ok=True)
+        return CachedAsset(final_body_path, meta)
+
+    def _write_meta(self, meta_path: Path, meta: dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def fetch(self, url: str) -> Tuple[int, Optional[CachedAsset]]:
+        """
+        Get `url` from the cache, going to the origin if it isn't cached or
+        stale. Returns the status code and, for a successful response, the asset.
+        Uncacheable responses are returned as an asset that is not in the index;
+        the caller should remove its file once served, see `is_cached`.
+
+        Responses of more than `max_asset_bytes` are neither cached nor served,
+        they are answered with 502 as soon as they grow that large.
+        """
+        host = urlsplit(url).netloc
+        key = hashlib.sha256(url.encode(HTML_ENCODING, HTML_ERRORS)).hexdigest()
+        cached = self._get(key)
+        if cached and cached.fresh:
+            ASSET_CACHE_REQUESTS.labels(host, "hit").inc()
+            return 200, cached
+
+        headers = {}
+        if cached:
+            if cached.meta.get("etag"):
+                headers["If-None-Match"] = cached.meta["etag"]
+            if cached.meta.get("last_modified"):
+                headers["If-Modified-Since"] = cached.meta["last_modified"]
+
+        try:
+            response = requests.get(
+                url, headers=headers, stream=True, timeout=self.timeout
+            )
+        except requests.RequestException:
+            if cached:
+                # serve stale rather than fail the render
+                logger.warning("asset cache: serving stale %s", url, exc_info=True)
+                ASSET_CACHE_REQUESTS.labels(host, "stale").inc()
+                return 200, cached
+            raise
+
+        with response:
+            lifetime = freshness_lifetime(response.headers, self.default_ttl)
+            if response.status_code == 304 and cached:
+                cached.meta["expires_at"] = time.time() + (lifetime or 0.0)
+                self._write_meta(self._paths(key)[1], cached.meta)
+                ASSET_CACHE_REQUESTS.labels(host, "revalidated").inc()
+                return 200, cached
+            if response.status_code != 200:
+                ASSET_CACHE_REQUESTS.labels(host, "error").inc()
+                return response.status_code, None
+            content_length = response.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > self.max_asset_bytes:
+                return self._too_large(host, url)
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+            size = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=ASSET_CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > self.max_asset_bytes:
+                        break
+                    f.write(chunk)
+            if size > self.max_asset_bytes:
+                os.remove(tmp_path)
+                return self._too_large(host, url)
+
+            meta = {
+                "url": url,
+                "content_type": response.headers.get("Content-Type"),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "expires_at": time.time() + (lifetime or 0.0),
+            }
+            if lifetime is None:
+                ASSET_CACHE_REQUESTS.labels(host, "uncacheable").inc()
+                return 200, CachedAsset(Path(tmp_path), meta)
+
+            ASSET_CACHE_REQUESTS.labels(host, "miss").inc()
+            return 200, self._store(key, Path(tmp_path), meta)
+
+    def _too_large(self, host: str, url: str) -> Tuple[int, None]:
+        logger.warning(
+            "asset cache: %s is larger than %d bytes", url, self.max_asset_bytes
+        )
+        ASSET_CACHE_REQUESTS.labels(host, "too_large").inc()
+        return 502, None
+
+    def is_cached(self, asset: CachedAsset) -> bool:
+        return asset.path.suffix == ".body"
+
+
+def serve_asset(
+    cache: AssetCache, proxy: AssetProxy, token: str
+) -> Tuple[int, Optional[CachedAsset], Optional[str]]:
+    """
+    Resolve a `/asset-cache/` token. Returns the status code, the asset and, for
+    stylesheets, the rewritten stylesheet to serve instead of the asset's file.
+    """
+    origin_url = proxy.origin_url(token)
+    if origin_url is None:
+        return 404, None, None
+
+    status_code, asset = cache.fetch(origin_url)
+    if asset is None:
+        return status_code, None, None
+
+    if asset.content_type.split(";")[0].strip().lower() == "text/css":
+        with open(asset.path, encoding=HTML_ENCODING, errors=HTML_ERRORS) as f:
+            css = proxy.rewrite_css(f.read(), origin_url)
+        return status_code, asset, css
+    return status_code, asset, None
+
+
+def read_asset(
+    cache: AssetCache, proxy: AssetProxy, token: str
+) -> Tuple[int, Optional[CachedAsset], Union[str, BinaryIO, None]]:
+    """
+    Like `serve_asset`, but returns the body to serve instead of the stylesheet:
+    the rewritten stylesheet or the asset's file, opened for reading. The file
+    of an asset that wasn't cached is removed, but stays readable until the
+    caller closes it. Blocks on the origin and the disk.
+    """
+    status_code, asset, css = serve_asset(cache, proxy, token)
+    if asset is None:
+        return status_code, None, None
+    try:
+        if css is not None:
+            return status_code, asset, css
+        return status_code, asset, open(asset.path, "rb")
+    finally:
+        if not cache.is_cached(asset):
+            try:
+                os.remove(asset.path)
+            except FileNotFoundError:
+                pass
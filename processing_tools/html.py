@@ -2,16 +2,42 @@ import logging
 import logging.config
 import os
 import subprocess
-import tempfile
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Tuple
 
 import requests
-from fastapi.responses import JSONResponse, Response
 from pydantic import AnyHttpUrl
 
+from processing_tools.assets import AssetProxy
+from processing_tools.html_split import split_html
 from processing_tools.logging.config import get_doc_processing_log_extra
-from processing_tools.types import HTML_TO_PDF_ENDPOINT, DocumentMeta
-from processing_tools.utils import filename_to_pdf_name
+from processing_tools.pdf import merge_pdfs, optimize_pdf
+from processing_tools.resilience import (
+    AttemptsFailedError,
+    CircuitBreaker,
+    CircuitOpenError,
+    hedged_call,
+)
+from processing_tools.types import (
+    HTML_TO_PDF_ENDPOINT,
+    DocumentMeta,
+    PDFOptimizeOptions,
+)
+from processing_tools.utils import get_content_length, save_download
+from processing_tools.workspace import (
+    JobOutput,
+    ScratchSpace,
+    job_input_path,
+    job_output_path,
+    new_job_id,
+    release_job,
+    remove_job_files,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,16 +47,116 @@ SCALE = 0.5
 MARGIN = {"top": "10px", "right": "35px", "bottom": "10px", "left": "35px"}
 
 
+class BrowserlessError(Exception):
+    """
+    Browserless answered with an error status.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"browserless responded with {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class BrowserlessUnavailableError(Exception):
+    """
+    No browserless endpoint could render: their circuits are open, they timed
+    out, couldn't be reached or answered with a server error.
+    """
+
+
+def is_browserless_failure(status_code: int) -> bool:
+    """
+    Whether a status means browserless itself is in trouble rather than the
+    request, and counts against its circuit breaker.
+    """
+    return status_code >= 500 or status_code == 429
+
+
+class BrowserlessClient:
+    """
+    Sends renders to one or more browserless endpoints, each behind its own
+    circuit breaker. Endpoints are tried in order until one succeeds; with
+    `hedge_after` set, the next endpoint is also tried when the previous one
+    took longer than that to answer, and the first answer wins.
+    """
+
+    def __init__(
+        self,
+        endpoints: Sequence[str],
+        breaker_factory: Callable[[str], CircuitBreaker],
+        timeout: Tuple[float, float],
+        hedge_after: float = 0,
+    ):
+        self.endpoints = list(endpoints)
+        self.breakers = {endpoint: breaker_factory(endpoint) for endpoint in endpoints}
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+
+    def _post(self, endpoint: str, path: str, params: dict) -> requests.Response:
+        breaker = self.breakers[endpoint]
+        if not breaker.allow():
+            raise CircuitOpenError(endpoint)
+
+        t_start = time.perf_counter()
+        ok = False
+        try:
+            response = requests.post(
+                f"{endpoint}{path}", json=params, stream=True, timeout=self.timeout
+            )
+            ok = not is_browserless_failure(response.status_code)
+        finally:
+            # whatever went wrong, or a half-open circuit waits for its trial
+            # call forever
+            breaker.record(ok, time.perf_counter() - t_start)
+        if not response.ok:
+            with response:
+                raise BrowserlessError(response.status_code, response.text)
+        return response
+
+    def post(self, path: str, params: dict) -> requests.Response:
+        """
+        POST `params` to `path` of the first endpoint that answers successfully.
+        Only the headers have been read when this returns.
+        """
+        try:
+            return hedged_call(
+                [
+                    partial(self._post, endpoint, path, params)
+                    for endpoint in self.endpoints
+                ],
+                self.hedge_after,
+                discard=requests.Response.close,
+            )
+        except AttemptsFailedError as e:
+            # an error of the request itself would be the same on every endpoint
+            for error in e.errors:
+                if isinstance(error, BrowserlessError) and not is_browserless_failure(
+                    error.status_code
+                ):
+                    raise error
+            raise BrowserlessUnavailableError(str(e)) from e
+
+
 def html_to_pdf_browserless(
-    url: AnyHttpUrl, meta: Optional[DocumentMeta], endpoint: str
-) -> Response:
-    browserless_url = f"{endpoint}/pdf"
+    url: AnyHttpUrl,
+    meta: Optional[DocumentMeta],
+    client: BrowserlessClient,
+    chunk_size: int,
+    scratch_space: ScratchSpace,
+    optimize: Optional[PDFOptimizeOptions] = None,
+    asset_proxy: Optional[AssetProxy] = None,
+) -> JobOutput:
+    """
+    Render `url` with browserless. With an `asset_proxy`, the page is fetched
+    here and browserless renders its HTML with the assets rewritten to the
+    asset cache.
+    """
     logger.debug(
         "Transformation started.",
         extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
     )
-    params = {
-        "url": url,
+    params: dict = {
         "options": {
             "printBackground": True,
             "scale": SCALE,
@@ -39,49 +165,53 @@ def html_to_pdf_browserless(
             # "format": "A0",
         },
     }
-    response = requests.post(browserless_url, json=params)
-    if not response.ok:
+    if asset_proxy:
+        page_response = requests.get(url, timeout=client.timeout)
+        page_response.raise_for_status()
+        params["html"] = asset_proxy.rewrite_html(page_response.text, url)
+    else:
+        params["url"] = url
+
+    try:
+        response = client.post("/pdf", params)
+    except (BrowserlessError, BrowserlessUnavailableError):
         logger.warning(
             {
                 "message": "Transformation failed.",
-                "response": response,
                 "url": url,
-            }
+            },
+            exc_info=True,
         )
-        return JSONResponse({"detail": response.text}, status_code=response.status_code)
-
-    logger.debug(
-        "Transformation completed.",
-        extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
-    )
-    return Response(content=response.content, media_type="application/pdf")
+        raise
 
+    scratch = scratch_space.reserve(get_content_length(response))
+    out_path = job_input_path(scratch.dir, new_job_id(), "pdf")
+    try:
+        out_path = save_download(response, out_path, chunk_size, scratch)
+        if optimize:
+            out_path = optimize_pdf(out_path, optimize, HTML_TO_PDF_ENDPOINT, meta)
+    except Exception:
+        release_job(scratch, out_path)
+        raise
 
-def html_to_pdf_wkhtmltopdf(
-    url: AnyHttpUrl, meta: Optional[DocumentMeta], chunk_size: int
-) -> Response:
     logger.debug(
-        "Transformation started.",
+        "Transformation completed.",
         extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
     )
+    return JobOutput(scratch, out_path)
 
-    # create temp file
-    file_handle, temp_path = tempfile.mkstemp()
-    web_path = f"{temp_path}.html"
-    out_path = filename_to_pdf_name(web_path)
-
-    input_file_response = requests.get(url)
-    with open(web_path, "wb") as f:
-        for chunk in input_file_response.iter_content(chunk_size=chunk_size):
-            f.write(chunk)
 
+def run_wkhtmltopdf(web_path: Path, out_path: Path, meta: Optional[DocumentMeta]):
+    """
+    Render the local HTML file `web_path` to `out_path`.
+    """
     process_args = [
         "wkhtmltopdf",
         # Disable local filesystem access and javascript for security
         "--disable-javascript",
         "--disable-local-file-access",
-        web_path,
-        out_path,
+        str(web_path),
+        str(out_path),
     ]
     try:
         subprocess.run(
@@ -100,17 +230,109 @@ def html_to_pdf_wkhtmltopdf(
                 extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
             )
             raise
+
+
+def run_wkhtmltopdf_split(
+    web_path: Path,
+    out_path: Path,
+    meta: Optional[DocumentMeta],
+    max_sections: int,
+    section_slots: Optional[threading.Semaphore] = None,
+):
+    """
+    Split `web_path` into sections at top-level body elements, render the
+    sections concurrently and merge them into `out_path`. Every section starts
+    on a new page.
+
+    Each section renders while holding one of `section_slots`, which is shared
+    by all requests to bound the wkhtmltopdf processes they start together.
+    """
+    # latin-1 maps every byte to one character, so the sections are written back
+    # byte for byte in whatever encoding the page uses
+    with open(web_path, encoding="latin-1", newline="") as f:
+        sections = split_html(f.read(), max_sections)
+
+    if len(sections) == 1:
+        run_wkhtmltopdf(web_path, out_path, meta)
+        return
+
+    logger.debug(
+        "Rendering in %d sections.",
+        len(sections),
+        extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
+    )
+    section_paths = [
+        web_path.with_name(f"{web_path.stem}-{idx}.html")
+        for idx in range(len(sections))
+    ]
+    section_out_paths = [job_output_path(path, "pdf") for path in section_paths]
+    try:
+        for section, section_path in zip(sections, section_paths):
+            with open(section_path, "w", encoding="latin-1", newline="") as f:
+                f.write(section)
+
+        def render(section_path: Path, section_out_path: Path) -> None:
+            with section_slots or nullcontext():
+                run_wkhtmltopdf(section_path, section_out_path, meta)
+
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            list(executor.map(render, section_paths, section_out_paths))
+
+        merge_pdfs(section_out_paths, out_path)
     finally:
-        os.close(file_handle)
-        os.remove(temp_path)
-        os.remove(web_path)
+        remove_job_files(*section_paths, *section_out_paths)
+
+
+def html_to_pdf_wkhtmltopdf(
+    url: AnyHttpUrl,
+    meta: Optional[DocumentMeta],
+    chunk_size: int,
+    scratch_space: ScratchSpace,
+    split_min_bytes: int = 0,
+    split_max_sections: int = 1,
+    optimize: Optional[PDFOptimizeOptions] = None,
+    asset_proxy: Optional[AssetProxy] = None,
+    split_section_slots: Optional[threading.Semaphore] = None,
+) -> JobOutput:
+    """
+    Render `url` with wkhtmltopdf. Pages of at least `split_min_bytes` are
+    rendered in up to `split_max_sections` concurrent sections, see
+    `run_wkhtmltopdf_split`. A `split_min_bytes` of 0 disables splitting.
+    The result is post-processed with `optimize_pdf` if `optimize` is given.
+    With an `asset_proxy`, the page's assets are loaded from the asset cache.
+    """
+    logger.debug(
+        "Transformation started.",
+        extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
+    )
+
+    input_file_response = requests.get(url, stream=True)
+    scratch = scratch_space.reserve(get_content_length(input_file_response))
+    web_path = job_input_path(scratch.dir, new_job_id(), "html")
+    out_path = job_output_path(web_path, "pdf")
 
-    with open(out_path, "rb") as f:
-        response_bytes = f.read()
-    os.remove(out_path)
+    try:
+        web_path = save_download(input_file_response, web_path, chunk_size, scratch)
+        out_path = job_output_path(web_path, "pdf")
+        os.makedirs(out_path.parent, exist_ok=True)
+        if asset_proxy:
+            asset_proxy.rewrite_html_file(web_path, url)
+        if split_min_bytes and os.path.getsize(web_path) >= split_min_bytes:
+            run_wkhtmltopdf_split(
+                web_path, out_path, meta, split_max_sections, split_section_slots
+            )
+        else:
+            run_wkhtmltopdf(web_path, out_path, meta)
+        if optimize:
+            out_path = optimize_pdf(out_path, optimize, HTML_TO_PDF_ENDPOINT, meta)
+    except Exception:
+        release_job(scratch, web_path, out_path)
+        raise
+    finally:
+        remove_job_files(web_path)
 
     logger.debug(
         "Transformation completed.",
         extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, meta),
     )
-    return Response(content=response_bytes, media_type="application/pdf")
+    return JobOutput(scratch, out_path)
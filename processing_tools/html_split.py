@@ -0,0 +1,121 @@
+"""
+Split a large HTML document into smaller documents that can be rendered
+independently and merged back together.
+
+Documents are split between the top-level elements of `<body>`. Every section
+keeps the original `<head>` (styles, charset, ...) and `<body>` attributes.
+"""
+from html.parser import HTMLParser
+from typing import List, Optional
+
+# elements that never have an end tag
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "param",
+    "source",
+    "track",
+    "wbr",
+}
+
+
+class BodyBoundaryParser(HTMLParser):
+    """
+    Finds the offsets at which the children of `<body>` start.
+
+    Offsets are indices into the string that was fed to the parser. Unclosed
+    elements are closed by the end tag of an enclosing element, so sloppy markup
+    only means fewer boundaries, not broken sections.
+    """
+
+    def __init__(self, text: str):
+        super().__init__(convert_charrefs=False)
+        self.text = text
+        # `getpos` counts lines by "\n" only, so we can't use `splitlines`
+        self.line_offsets = [0]
+        for line in text.split("\n"):
+            self.line_offsets.append(self.line_offsets[-1] + len(line) + 1)
+
+        self.body_start: Optional[int] = None
+        self.body_end: Optional[int] = None
+        self.boundaries: List[int] = []
+        self.open_elements: List[str] = []
+
+    def position(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if self.body_end is not None:
+            return
+        if tag == "body" and self.body_start is None:
+            start_tag = self.get_starttag_text() or ""
+            self.body_start = self.position() + len(start_tag)
+            return
+        if self.body_start is None:
+            return
+
+        if not self.open_elements:
+            self.boundaries.append(self.position())
+        if tag not in VOID_ELEMENTS:
+            self.open_elements.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.body_start is not None and self.body_end is None:
+            if not self.open_elements:
+                self.boundaries.append(self.position())
+
+    def handle_endtag(self, tag):
+        if self.body_start is None or self.body_end is not None:
+            return
+        if tag in ("body", "html"):
+            self.body_end = self.position()
+        elif tag in self.open_elements:
+            while self.open_elements.pop() != tag:
+                pass
+
+
+def split_html(text: str, max_sections: int) -> List[str]:
+    """
+    Split `text` into at most `max_sections` complete HTML documents of roughly
+    equal size. Returns `[text]` if it can not be split.
+
+    >>> sections = split_html("<html><body><p>a</p><p>b</p></body></html>", 2)
+    >>> sections
+    ['<html><body><p>a</p></body></html>', '<html><body><p>b</p></body></html>']
+    """
+    if max_sections < 2:
+        return [text]
+
+    parser = BodyBoundaryParser(text)
+    parser.feed(text)
+    parser.close()
+
+    if parser.body_start is None:
+        return [text]
+    body_start = parser.body_start
+    body_end = parser.body_end if parser.body_end is not None else len(text)
+    head = text[:body_start]
+    tail = text[body_end:] if parser.body_end is not None else "</body></html>"
+
+    # cut at the first boundary past each multiple of the section size
+    section_size = (body_end - body_start) / max_sections
+    cuts = [body_start]
+    for boundary in parser.boundaries:
+        if len(cuts) == max_sections:
+            break
+        if boundary > cuts[-1] and boundary >= body_start + len(cuts) * section_size:
+            cuts.append(boundary)
+    cuts.append(body_end)
+
+    if len(cuts) < 3:
+        return [text]
+    return [head + text[start:end] + tail for start, end in zip(cuts, cuts[1:])]
@@ -0,0 +1,33 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List
+
+
+class LibreOfficePool:
+    """
+    `workers` libreoffice processes that may convert at the same time.
+
+    libreoffice can't run twice on the same user profile: a second process hands
+    its document to the running one and exits without converting it. Every
+    worker gets its own profile under `profile_dir`, named after the pool, so
+    the workers of different pools don't share one either.
+    """
+
+    def __init__(self, name: str, workers: int, profile_dir: str):
+        self.workers = workers
+        self._profiles: "asyncio.Queue[Path]" = asyncio.Queue()
+        for worker in range(workers):
+            self._profiles.put_nowait(Path(profile_dir) / f"{name}-{worker}")
+
+    @asynccontextmanager
+    async def worker(self) -> AsyncIterator[List[str]]:
+        """
+        Wait for a free worker. Yields the arguments selecting its profile, to be
+        passed to libreoffice.
+        """
+        profile = await self._profiles.get()
+        try:
+            yield [f"-env:UserInstallation={profile.absolute().as_uri()}"]
+        finally:
+            self._profiles.put_nowait(profile)
@@ -49,7 +49,13 @@ class DocProcessingLogExtras(DocProcessingLogExtrasBase, total=False):
     error_detail: Optional[str]
     size_bytes: int
     file_extension: str
+    file_format: str
     processing_time: float
+    scratch_medium: str
+    optimized_size_bytes: int
+    optimization_time: float
+    member_count: int
+    failed_member_count: int
 
 
 def get_doc_processing_log_extra(
@@ -1,36 +1,121 @@
+import asyncio
 import logging
 import logging.config
 import os
-import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Literal, Optional, Union
+from typing import (
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    TypeVar,
+    Union,
+)
 
-import sentry_sdk
-from fastapi import FastAPI, HTTPException, status
-from fastapi.responses import JSONResponse, Response
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from prometheus_fastapi_instrumentator import Instrumentator  # type: ignore
 from pydantic import AnyHttpUrl, BaseModel
-from rich.logging import RichHandler
-from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
-
-from processing_tools.html import html_to_pdf_browserless, html_to_pdf_wkhtmltopdf
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+import processing_tools
+from processing_tools import office, spreadsheet
+from processing_tools.archive import (
+    MANIFEST_HEADER,
+    ArchiveLimitError,
+    ArchiveOutput,
+    ConvertedMember,
+    NoMembersConvertedError,
+    convert_members,
+    list_members,
+    manifest,
+    manifest_header,
+    write_zip,
+)
+from processing_tools.assets import (
+    ASSET_CHUNK_BYTES,
+    AssetCache,
+    AssetProxy,
+    read_asset,
+)
+from processing_tools.html import (
+    BrowserlessClient,
+    BrowserlessError,
+    BrowserlessUnavailableError,
+    html_to_pdf_browserless,
+    html_to_pdf_wkhtmltopdf,
+)
 from processing_tools.logging.config import get_doc_processing_log_extra
+from processing_tools.metrics import (
+    BROWSERLESS_FALLBACKS,
+    INPUT_FORMATS,
+    STARTUP_SECONDS,
+)
 from processing_tools.office import OfficeDocumentConverter
+from processing_tools.pdf import merge_pdfs, optimize_pdf
+from processing_tools.pipeline import PrefetchPool
+from processing_tools.profiling import (
+    LoopMonitor,
+    ProfilingMiddleware,
+    RequestProfiles,
+    require_admin,
+    sample_stacks,
+)
+from processing_tools.resilience import CircuitBreaker
+from processing_tools.responses import ZeroCopyFileResponse
 from processing_tools.settings import settings
+from processing_tools.singleflight import Flight, SingleFlight
+from processing_tools.sniff import UnsupportedFormatError, sniff_format
 from processing_tools.spreadsheet import XLSToXLSXConverter
 from processing_tools.types import (
+    ARCHIVE_TO_PDF_ENDPOINT,
     HTML_TO_PDF_ENDPOINT,
     OD_TO_PDF_ENDPOINT,
     XLS_TO_XLSX_ENDPOINT,
     DocumentMeta,
+    Endpoint,
+    FileConverter,
+    PDFOptimizeOptions,
+)
+from processing_tools.utils import (
+    get_content_length,
+    get_extension,
+    open_download,
+    save_download,
+)
+from processing_tools.warmup import WarmUp, process_uptime
+from processing_tools.workspace import (
+    JobOutput,
+    ScratchReservation,
+    ScratchSpace,
+    job_input_path,
+    job_output_path,
+    new_job_id,
+    release_job,
+    remove_job_files,
+    sweep_orphaned_files,
 )
-from processing_tools.utils import download_local_file, get_extension
 
 if not settings.debug:
     logging.config.fileConfig("processing_tools/logging/logging.conf")
     logger = logging.getLogger(__name__)
 else:
+    # only needed in debug mode, so production doesn't pay for importing it
+    from rich.logging import RichHandler
+
     logging.basicConfig(
         level="NOTSET",
         format="%(message)s",
@@ -63,10 +148,22 @@ instrumentator.instrument(app)
 instrumentator.expose(app, should_gzip=True)
 
 
+request_profiles = RequestProfiles(
+    settings.profiling_dir, settings.profiling_max_request_profiles
+)
+app.add_middleware(ProfilingMiddleware, profiles=request_profiles)
+loop_monitor = LoopMonitor(
+    settings.loop_monitor_interval, settings.loop_block_threshold, max_blocks=50
+)
+
+
 ########################
 # Sentry Configuration #
 ########################
 if settings.sentry_dsn:
+    import sentry_sdk
+    from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
+
     sentry_sdk.init(
         dsn=settings.sentry_dsn,
         environment=settings.environment,
@@ -76,10 +173,115 @@ if settings.sentry_dsn:
     app.add_middleware(SentryAsgiMiddleware)
 
 
+scratch_space = ScratchSpace(
+    settings.work_dir,
+    settings.scratch_memory_dir,
+    settings.scratch_memory_max_file_bytes,
+    settings.scratch_memory_budget_bytes,
+)
+
+
+def new_prefetch_pool(workers: int) -> PrefetchPool:
+    # at least one job more than the engine's workers, so the next input is
+    # downloaded while they convert
+    return PrefetchPool(
+        max(settings.prefetch_max_jobs, workers + 1), settings.prefetch_max_bytes
+    )
+
+
+# the libreoffice endpoints have workers of their own, and so their own prefetch
+# pools: a backlog on one doesn't hold the downloads of the other back
+prefetch_pools: Dict[Endpoint, PrefetchPool] = {
+    OD_TO_PDF_ENDPOINT: new_prefetch_pool(office.pool.workers),
+    XLS_TO_XLSX_ENDPOINT: new_prefetch_pool(spreadsheet.pool.workers),
+}
+
+asset_cache: Optional[AssetCache] = None
+asset_cache_executor: Optional[ThreadPoolExecutor] = None
+local_asset_proxy: Optional[AssetProxy] = None
+public_asset_proxy: Optional[AssetProxy] = None
+if settings.asset_cache_enabled:
+    asset_cache = AssetCache(
+        settings.asset_cache_dir,
+        settings.asset_cache_max_bytes,
+        settings.asset_cache_max_asset_bytes,
+        settings.asset_cache_default_ttl,
+        settings.asset_cache_timeout,
+    )
+    asset_cache_executor = ThreadPoolExecutor(
+        settings.asset_cache_threads, thread_name_prefix="asset-cache"
+    )
+    local_asset_proxy = AssetProxy(
+        settings.asset_cache_local_url, settings.asset_cache_secret
+    )
+    public_asset_proxy = AssetProxy(
+        settings.asset_cache_public_url, settings.asset_cache_secret
+    )
+
+
+browserless_client = BrowserlessClient(
+    [
+        endpoint.strip()
+        for endpoint in settings.browserless_server_endpoint.split(",")
+        if endpoint.strip()
+    ],
+    partial(
+        CircuitBreaker,
+        window=settings.browserless_breaker_window,
+        min_calls=settings.browserless_breaker_min_calls,
+        error_ratio=settings.browserless_breaker_error_ratio,
+        slow_call_seconds=settings.browserless_breaker_slow_seconds,
+        slow_call_ratio=settings.browserless_breaker_slow_ratio,
+        open_seconds=settings.browserless_breaker_open_seconds,
+    ),
+    (settings.browserless_connect_timeout, settings.browserless_read_timeout),
+    settings.browserless_hedge_after,
+)
+
+# wkhtmltopdf processes rendering sections of split pages, across all requests
+wkhtmltopdf_section_slots = threading.BoundedSemaphore(settings.html_split_max_sections)
+
+warm_up = WarmUp(
+    settings.warmup_files_dir,
+    scratch_space,
+    browserless_client.endpoints,
+    settings.warmup_timeout,
+)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    STARTUP_SECONDS.labels("startup").set(process_uptime())
+    if not settings.warmup_enabled:
+        warm_up.done = True
+        STARTUP_SECONDS.labels("ready").set(process_uptime())
+        return
+
+    warm_up.start()
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    if settings.loop_monitor_interval:
+        loop_monitor.start()
+
+
+@app.on_event("startup")
+async def start_orphaned_file_sweeper():
+    for root in scratch_space.roots:
+        os.makedirs(root, exist_ok=True)
+        asyncio.create_task(
+            sweep_orphaned_files(
+                root, settings.work_file_max_age, settings.work_sweep_interval
+            )
+        )
+
+
 class ConversionRequest(BaseModel):
     url: AnyHttpUrl
     meta: Optional[DocumentMeta]
     engine: Union[Literal["browserless"], Literal["wkhtmltopdf"]]
+    optimize: Optional[PDFOptimizeOptions]
 
 
 class ConversionURLOnlyRequest(BaseModel):
@@ -87,53 +289,151 @@ class ConversionURLOnlyRequest(BaseModel):
     meta: Optional[DocumentMeta]
 
 
-@app.post("/xls_to_xlsx/", tags=["XLSToXLSX"])
-async def xls_to_xlsx(request: ConversionURLOnlyRequest) -> Response:
-    t_start = time.time()
-    logger.info(
-        "xls_to_xlsx starting 🏎",
-        extra=get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, request.meta),
+class PDFConversionURLOnlyRequest(ConversionURLOnlyRequest):
+    optimize: Optional[PDFOptimizeOptions]
+
+
+class ArchiveConversionRequest(PDFConversionURLOnlyRequest):
+    # one PDF with the pages of all members, or a zip with a PDF per member
+    output: Literal["pdf", "zip"] = "pdf"
+
+
+xls_to_xlsx_flights: SingleFlight[JobOutput] = SingleFlight(XLS_TO_XLSX_ENDPOINT)
+od_to_pdf_flights: SingleFlight[JobOutput] = SingleFlight(OD_TO_PDF_ENDPOINT)
+html_to_pdf_flights: SingleFlight[JobOutput] = SingleFlight(HTML_TO_PDF_ENDPOINT)
+archive_to_pdf_flights: SingleFlight[ArchiveOutput] = SingleFlight(
+    ARCHIVE_TO_PDF_ENDPOINT
+)
+
+
+def coalescing_key(request: BaseModel) -> str:
+    """
+    Concurrent requests for the same url with the same options share one
+    conversion, whatever their meta.
+    """
+    return request.json(exclude={"meta"})
+
+
+J = TypeVar("J", bound=JobOutput)
+
+
+def file_response(
+    flight: Flight[J], media_type: str, headers: Optional[dict] = None
+) -> Response:
+    return ZeroCopyFileResponse(
+        flight.result.path,
+        media_type=media_type,
+        headers=headers,
+        background=BackgroundTask(flight.release),
     )
-    try:
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
 
-            extension = get_extension(request.url.path or "")
-            in_path = Path(os.path.join(tmp_dir, f"file.{extension}"))
-            out_path = Path(os.path.join(tmp_dir, "file.xlsx"))
+async def convert_file(
+    endpoint: Endpoint,
+    request: ConversionURLOnlyRequest,
+    converter: FileConverter,
+    optimize: Optional[PDFOptimizeOptions] = None,
+) -> JobOutput:
+    """
+    Download `request.url` to scratch space and convert it with `converter`.
+
+    Downloads run ahead of the converter within the limits of the endpoint's
+    pool in `prefetch_pools`.
+    """
+    extension = get_extension(request.url.path or "")
+    in_path: Optional[Path] = None
+    out_path: Optional[Path] = None
+    scratch: Optional[ScratchReservation] = None
+    try:
+        async with prefetch_pools[endpoint].slot() as prefetch:
+            download = await run_in_threadpool(open_download, request.url)
+            if not download.ok:
+                # don't convert the origin's error page
+                download.close()
+                download.raise_for_status()
+            content_length = get_content_length(download)
+            await prefetch.reserve(
+                settings.prefetch_unknown_size_bytes
+                if content_length is None
+                else content_length
+            )
+            scratch = scratch_space.reserve(content_length)
+            in_path = job_input_path(scratch.dir, new_job_id(), extension)
+            in_path = await run_in_threadpool(
+                save_download, download, in_path, scratch=scratch
+            )
+            prefetch.grow(max(os.path.getsize(in_path) - prefetch.size, 0))
 
-            download_local_file(request.url, in_path)
+            # check the input before it waits for the engine, which takes
+            # seconds to fail on inputs it can't read
+            file_format = await run_in_threadpool(sniff_format, in_path, extension)
 
-            extra = get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, request.meta)
+            extra = get_doc_processing_log_extra(endpoint, request.meta)
             extra["file_extension"] = extension
+            extra["file_format"] = file_format or "unknown"
             extra["size_bytes"] = os.path.getsize(in_path)
+            extra["scratch_medium"] = scratch.medium
 
             logger.debug(
-                "xls_to_xlsx downloaded file",
+                "%s downloaded file",
+                endpoint,
                 extra=extra,
             )
 
-            converter = XLSToXLSXConverter(request.meta)
-            converted_bytes = await converter.convert(in_path)
+            if file_format == converter.output_extension:
+                INPUT_FORMATS.labels(endpoint, file_format, "passthrough").inc()
+                out_path = converter.output_path(in_path)
+                os.makedirs(out_path.parent, exist_ok=True)
+                os.replace(in_path, out_path)
+            elif file_format in converter.input_formats:
+                INPUT_FORMATS.labels(endpoint, file_format, "convert").inc()
+                if file_format != extension:
+                    # libreoffice picks its import filter by extension
+                    sniffed_path = in_path.with_suffix(f".{file_format}")
+                    os.replace(in_path, sniffed_path)
+                    in_path = sniffed_path
+                out_path = converter.output_path(in_path)
+                await converter.convert(in_path)
+            else:
+                INPUT_FORMATS.labels(endpoint, extra["file_format"], "reject").inc()
+                raise UnsupportedFormatError(file_format)
+
+        if optimize:
+            out_path = await run_in_threadpool(
+                optimize_pdf, out_path, optimize, endpoint, request.meta
+            )
 
-            t_total = time.time() - t_start
+    except Exception:
+        release_job(scratch, in_path, out_path)
+        raise
 
-            extra = get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, request.meta)
-            extra["file_extension"] = extension
-            extra["size_bytes"] = os.path.getsize(in_path)
-            extra["processing_time"] = t_total
-            logger.info(
-                "xls_to_xlsx finished 🏁",
-                extra=extra,
-            )
+    remove_job_files(in_path)
+    return JobOutput(scratch, out_path)
 
-            headers = {
-                "Content-Disposition": f"attachment; filename={os.path.basename(out_path)}"
-            }
-            return Response(
-                content=converted_bytes, media_type="application/xlsx", headers=headers
-            )
 
+@app.post("/xls_to_xlsx/", tags=["XLSToXLSX"])
+async def xls_to_xlsx(request: ConversionURLOnlyRequest) -> Response:
+    t_start = time.time()
+    logger.info(
+        "xls_to_xlsx starting 🏎",
+        extra=get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, request.meta),
+    )
+    try:
+        flight = await xls_to_xlsx_flights.do(
+            coalescing_key(request),
+            lambda: convert_file(
+                XLS_TO_XLSX_ENDPOINT, request, XLSToXLSXConverter(request.meta)
+            ),
+            JobOutput.release,
+        )
+
+    except UnsupportedFormatError as e:
+        logger.warning(
+            "xls_to_xlsx rejected input: %s",
+            e,
+            extra=get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, request.meta),
+        )
+        return Response(str(e), status_code=415)
     except Exception:
         logger.exception(
             "xls_to_xlsx errored 🪵",
@@ -141,60 +441,228 @@ async def xls_to_xlsx(request: ConversionURLOnlyRequest) -> Response:
         )
         return Response("Could not convert file to xlsx", status_code=500)
 
+    t_total = time.time() - t_start
+
+    extra = get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, request.meta)
+    extra["file_extension"] = get_extension(request.url.path or "")
+    extra["processing_time"] = t_total
+    logger.info(
+        "xls_to_xlsx finished 🏁",
+        extra=extra,
+    )
+
+    headers = {"Content-Disposition": "attachment; filename=file.xlsx"}
+    return file_response(flight, "application/xlsx", headers)
+
 
 @app.post("/od_to_pdf/", tags=["OpenDocToPDF"])
-async def od_to_pdf(request: ConversionURLOnlyRequest) -> Response:
+async def od_to_pdf(request: PDFConversionURLOnlyRequest) -> Response:
     t_start = time.time()
     logger.info(
         "od_to_pdf starting 🏎",
         extra=get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta),
     )
     try:
+        flight = await od_to_pdf_flights.do(
+            coalescing_key(request),
+            lambda: convert_file(
+                OD_TO_PDF_ENDPOINT,
+                request,
+                OfficeDocumentConverter(request.meta),
+                request.optimize,
+            ),
+            JobOutput.release,
+        )
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
+    except UnsupportedFormatError as e:
+        logger.warning(
+            "od_to_pdf rejected input: %s",
+            e,
+            extra=get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta),
+        )
+        return Response(str(e), status_code=415)
+    except Exception:
+        logger.exception(
+            "od_to_pdf errored 🪵",
+            extra=get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta),
+        )
+        return Response("Could not convert file to pdf", status_code=500)
 
-            extension = get_extension(request.url.path or "")
-            in_path = Path(os.path.join(tmp_dir, f"file.{extension}"))
-            out_path = Path(os.path.join(tmp_dir, "file.pdf"))
+    t_total = time.time() - t_start
 
-            download_local_file(request.url, in_path)
+    extra = get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta)
+    extra["file_extension"] = get_extension(request.url.path or "")
+    extra["processing_time"] = t_total
+    logger.info(
+        "od_to_pdf finished 🏁",
+        extra=extra,
+    )
 
-            extra = get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta)
-            extra["file_extension"] = extension
-            extra["size_bytes"] = os.path.getsize(in_path)
+    headers = {"Content-Disposition": "attachment; filename=file.pdf"}
+    return file_response(flight, "application/pdf", headers)
 
-            logger.debug(
-                "od_to_pdf downloaded file",
-                extra=extra,
-            )
 
-            converter = OfficeDocumentConverter(request.meta)
-            converted_bytes = await converter.convert(in_path)
+async def convert_archive(request: ArchiveConversionRequest) -> ArchiveOutput:
+    """
+    Download the zip archive at `request.url`, convert its members to PDF across
+    the libreoffice workers and combine them as `request.output` asks for.
+    """
+    endpoint = ARCHIVE_TO_PDF_ENDPOINT
+    archive_path: Optional[Path] = None
+    out_path: Optional[Path] = None
+    scratch: Optional[ScratchReservation] = None
+    converted: List[ConvertedMember] = []
+    try:
+        download = await run_in_threadpool(open_download, request.url)
+        if not download.ok:
+            download.close()
+            download.raise_for_status()
+        # members expand to many times the size of the archive, keep them off
+        # memory-backed scratch space
+        scratch = scratch_space.reserve(None)
+        archive_path = job_input_path(scratch.dir, new_job_id(), "zip")
+        archive_path = await run_in_threadpool(
+            save_download, download, archive_path, scratch=scratch
+        )
 
-            t_total = time.time() - t_start
+        extension = get_extension(request.url.path or "")
+        file_format = await run_in_threadpool(sniff_format, archive_path, extension)
+        if file_format != "zip":
+            INPUT_FORMATS.labels(endpoint, file_format or "unknown", "reject").inc()
+            raise UnsupportedFormatError(file_format)
+        members = await run_in_threadpool(
+            list_members,
+            archive_path,
+            settings.archive_max_members,
+            settings.archive_max_uncompressed_bytes,
+        )
 
-            extra = get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta)
-            extra["file_extension"] = extension
-            extra["size_bytes"] = os.path.getsize(in_path)
-            extra["processing_time"] = t_total
-            logger.info(
-                "od_to_pdf finished 🏁",
-                extra=extra,
+        finish = None
+        if request.optimize:
+            finish = partial(
+                optimize_pdf,
+                options=request.optimize,
+                endpoint=endpoint,
+                meta=request.meta,
             )
+        converted = await convert_members(
+            endpoint,
+            request.meta,
+            archive_path,
+            members,
+            scratch.dir,
+            OfficeDocumentConverter(request.meta),
+            # leave workers to the single files queued behind the archive
+            max(office.pool.workers // 2, 1),
+            prefetch_pools[OD_TO_PDF_ENDPOINT],
+            finish,
+        )
+        outputs = [path for _, path in converted if path is not None]
+        if not outputs:
+            raise NoMembersConvertedError([result for result, _ in converted])
+
+        out_path = job_output_path(archive_path, request.output)
+        if request.output == "zip":
+            await run_in_threadpool(write_zip, converted, "pdf", out_path)
+        elif len(outputs) == 1:
+            os.replace(outputs[0], out_path)
+        else:
+            await run_in_threadpool(merge_pdfs, outputs, out_path)
+
+    except Exception:
+        release_job(scratch, archive_path, out_path, *(path for _, path in converted))
+        raise
+
+    remove_job_files(archive_path, *(path for _, path in converted))
+    return ArchiveOutput(scratch, out_path, [result for result, _ in converted])
 
-            headers = {
-                "Content-Disposition": f"attachment; filename={os.path.basename(out_path)}"
-            }
-            return Response(
-                content=converted_bytes, media_type="application/pdf", headers=headers
-            )
 
+@app.post("/archive_to_pdf/", tags=["ArchiveToPDF"])
+async def archive_to_pdf(request: ArchiveConversionRequest) -> Response:
+    t_start = time.time()
+    logger.info(
+        "archive_to_pdf starting 🏎",
+        extra=get_doc_processing_log_extra(ARCHIVE_TO_PDF_ENDPOINT, request.meta),
+    )
+    try:
+        flight = await archive_to_pdf_flights.do(
+            coalescing_key(request),
+            lambda: convert_archive(request),
+            ArchiveOutput.release,
+        )
+
+    except (UnsupportedFormatError, ArchiveLimitError) as e:
+        logger.warning(
+            "archive_to_pdf rejected input: %s",
+            e,
+            extra=get_doc_processing_log_extra(ARCHIVE_TO_PDF_ENDPOINT, request.meta),
+        )
+        status_code = 413 if isinstance(e, ArchiveLimitError) else 415
+        return Response(str(e), status_code=status_code)
+    except NoMembersConvertedError as e:
+        logger.warning(
+            "archive_to_pdf converted nothing: %s",
+            e,
+            extra=get_doc_processing_log_extra(ARCHIVE_TO_PDF_ENDPOINT, request.meta),
+        )
+        return JSONResponse(manifest(e.members), status_code=422)
     except Exception:
         logger.exception(
-            "od_to_pdf errored 🪵",
-            extra=get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, request.meta),
+            "archive_to_pdf errored 🪵",
+            extra=get_doc_processing_log_extra(ARCHIVE_TO_PDF_ENDPOINT, request.meta),
         )
-        return Response("Could not convert file to pdf", status_code=500)
+        return Response("Could not convert archive", status_code=500)
+
+    t_total = time.time() - t_start
+    members = flight.result.members
+
+    extra = get_doc_processing_log_extra(ARCHIVE_TO_PDF_ENDPOINT, request.meta)
+    extra["processing_time"] = t_total
+    extra["member_count"] = len(members)
+    extra["failed_member_count"] = sum(
+        member["status"] == "error" for member in members
+    )
+    logger.info(
+        "archive_to_pdf finished 🏁",
+        extra=extra,
+    )
+
+    if request.output == "zip":
+        headers = {"Content-Disposition": "attachment; filename=files.zip"}
+        return file_response(flight, "application/zip", headers)
+
+    headers = {
+        "Content-Disposition": "attachment; filename=file.pdf",
+        MANIFEST_HEADER: manifest_header(members),
+    }
+    return file_response(flight, "application/pdf", headers)
+
+
+def html_to_pdf_browserless_or_fallback(
+    request: ConversionRequest, fallback: Callable[[], JobOutput]
+) -> JobOutput:
+    """
+    Render with browserless, or with `fallback` while browserless is unavailable.
+    """
+    try:
+        return html_to_pdf_browserless(
+            request.url,
+            request.meta,
+            browserless_client,
+            settings.iter_chunk_size,
+            scratch_space,
+            request.optimize,
+            public_asset_proxy,
+        )
+    except BrowserlessUnavailableError:
+        if not settings.browserless_fallback_enabled:
+            raise
+        logger.warning(
+            "html_to_pdf: browserless unavailable, falling back to wkhtmltopdf",
+            extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, request.meta),
+        )
+        BROWSERLESS_FALLBACKS.inc()
+        return fallback()
 
 
 @app.post("/html_to_pdf/")
@@ -205,15 +673,26 @@ async def html_to_pdf(request: ConversionRequest) -> Response:
         extra=get_doc_processing_log_extra(HTML_TO_PDF_ENDPOINT, request.meta),
     )
 
+    render_wkhtmltopdf = partial(
+        html_to_pdf_wkhtmltopdf,
+        request.url,
+        request.meta,
+        settings.iter_chunk_size,
+        scratch_space,
+        settings.html_split_min_bytes,
+        settings.html_split_max_sections,
+        request.optimize,
+        local_asset_proxy,
+        wkhtmltopdf_section_slots,
+    )
+
     if request.engine == "browserless":
-        return html_to_pdf_browserless(
-            request.url, request.meta, settings.browserless_server_endpoint
+        render = partial(
+            html_to_pdf_browserless_or_fallback, request, render_wkhtmltopdf
         )
 
     elif request.engine == "wkhtmltopdf":
-        return html_to_pdf_wkhtmltopdf(
-            request.url, request.meta, settings.iter_chunk_size
-        )
+        render = render_wkhtmltopdf
 
     else:
         logger.error(
@@ -223,14 +702,119 @@ async def html_to_pdf(request: ConversionRequest) -> Response:
         )
         return Response("Unknown or missing engine", status_code=400)
 
+    try:
+        flight = await html_to_pdf_flights.do(
+            coalescing_key(request),
+            lambda: run_in_threadpool(render),
+            JobOutput.release,
+        )
+    except BrowserlessError as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code)
+    except BrowserlessUnavailableError:
+        return JSONResponse({"detail": "browserless is unavailable"}, status_code=503)
+
+    return file_response(flight, "application/pdf")
+
+
+async def stream_asset(
+    f: BinaryIO, executor: ThreadPoolExecutor
+) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    try:
+        while chunk := await loop.run_in_executor(executor, f.read, ASSET_CHUNK_BYTES):
+            yield chunk
+    finally:
+        f.close()
+
+
+@app.get("/asset-cache/{token}")
+async def asset_cache_proxy(token: str, request: Request) -> Response:
+    """
+    Serve an asset of a page being rendered from the asset cache, see
+    `processing_tools.assets`.
+
+    Renders wait for their assets while holding threads of the thread pool, so
+    this runs in `asset_cache_executor` instead; with threads from the pool, a
+    full pool of renders would wait forever. For the same reason files are
+    streamed from that executor, not with `FileResponse`.
+    """
+    if asset_cache is None or asset_cache_executor is None:
+        return Response(status_code=404)
+
+    # stylesheets are rewritten for the address the renderer used to get here
+    proxy = AssetProxy(str(request.base_url), settings.asset_cache_secret)
+    try:
+        status_code, asset, body = await asyncio.get_running_loop().run_in_executor(
+            asset_cache_executor, read_asset, asset_cache, proxy, token
+        )
+    except Exception:
+        logger.exception("asset cache: fetching asset failed")
+        return Response(status_code=502)
+    if asset is None or body is None:
+        return Response(status_code=status_code)
+    if isinstance(body, str):
+        return Response(body, media_type=asset.content_type)
+    return StreamingResponse(
+        stream_asset(body, asset_cache_executor),
+        media_type=asset.content_type,
+        headers={"Content-Length": str(os.fstat(body.fileno()).st_size)},
+    )
+
 
 @app.get("/ping")
 def ping():
     return "OK"
 
 
+@app.get("/ready")
+def ready() -> Response:
+    """
+    Whether the engines have been warmed up and the instance should get traffic.
+    """
+    return JSONResponse(
+        {"ready": warm_up.done, "engines": warm_up.engines},
+        status_code=200 if warm_up.done else 503,
+    )
+
+
+@app.get("/admin/profiling/sample", dependencies=[Depends(require_admin)])
+async def profiling_sample(
+    seconds: float = Query(10, gt=0, le=settings.profiling_max_seconds),
+    interval: float = Query(0.01, ge=0.001),
+) -> Response:
+    """
+    Sample the stacks of all threads for `seconds` seconds. Open the result in
+    https://www.speedscope.app.
+    """
+    profile = await run_in_threadpool(sample_stacks, seconds, interval)
+    headers = {"Content-Disposition": "attachment; filename=profile.speedscope.json"}
+    return JSONResponse(profile, headers=headers)
+
+
+@app.get(
+    "/admin/profiling/requests/{profile_id}", dependencies=[Depends(require_admin)]
+)
+def profiling_request(profile_id: str) -> Response:
+    """
+    The cProfile stats of a request profiled with the `X-Profile` header or the
+    `profile` meta flag, by the id in its `X-Profile-Id` header.
+    """
+    path = request_profiles.path(profile_id)
+    if path is None or not path.exists():
+        return Response(status_code=404)
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+
+
+@app.get("/admin/profiling/loop-blocks", dependencies=[Depends(require_admin)])
+def profiling_loop_blocks() -> Response:
+    """
+    The recent times the event loop was blocked, with the stack blocking it.
+    """
+    return JSONResponse({"blocks": list(loop_monitor.blocks)})
+
+
 @app.exception_handler(HTTPException)
-def handle_exception(exc):
+def handle_exception(request: Request, exc: HTTPException):
     logger.error(
         {
             "message": "HTTPException caught.",
@@ -238,6 +822,12 @@ def handle_exception(exc):
         }
     )
     return JSONResponse(
-        {"code": exc.code, "name": exc.name, "description": exc.description},
-        status_code=status.HTTP_404_NOT_FOUND,
+        {"detail": exc.detail},
+        status_code=exc.status_code,
+        headers=exc.headers,
     )
+
+
+STARTUP_SECONDS.labels("import").set(
+    time.perf_counter() - processing_tools.IMPORT_STARTED
+)
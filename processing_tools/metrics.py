@@ -0,0 +1,106 @@
+"""
+Application metrics. These are registered in the default prometheus registry and
+are exposed on `/metrics` alongside the request metrics of the instrumentator.
+"""
+from prometheus_client import Counter, Gauge, Histogram  # type: ignore
+
+SCRATCH_BYTES = Gauge(
+    "processing_tools_scratch_bytes",
+    "Bytes of scratch space currently reserved by conversion jobs.",
+    ["medium"],
+)
+SCRATCH_RESERVATIONS = Counter(
+    "processing_tools_scratch_reservations_total",
+    "Scratch space reservations made by conversion jobs.",
+    ["medium"],
+)
+SCRATCH_SPILLS = Counter(
+    "processing_tools_scratch_spills_total",
+    "Jobs small enough for memory-backed scratch space that spilled to disk "
+    "because the memory budget was exhausted or their input was larger than "
+    "announced.",
+)
+PDF_OPTIMIZATION_SECONDS = Histogram(
+    "processing_tools_pdf_optimization_seconds",
+    "Time spent optimizing converted PDFs.",
+    ["endpoint"],
+)
+PDF_OPTIMIZATION_SAVED_BYTES = Counter(
+    "processing_tools_pdf_optimization_saved_bytes_total",
+    "Bytes saved by optimizing converted PDFs.",
+    ["endpoint"],
+)
+COALESCED_REQUESTS = Counter(
+    "processing_tools_coalesced_requests_total",
+    "Requests that were answered by an identical conversion already in flight "
+    "instead of converting again.",
+    ["endpoint"],
+)
+PREFETCH_JOBS = Gauge(
+    "processing_tools_prefetch_jobs",
+    "Jobs downloading their input or holding a downloaded input for the engine.",
+)
+PREFETCH_BYTES = Gauge(
+    "processing_tools_prefetch_bytes",
+    "Bytes of input held by jobs in the prefetch pool.",
+)
+ENGINE_WAIT_SECONDS = Histogram(
+    "processing_tools_engine_wait_seconds",
+    "Time jobs with a downloaded input waited for the engine.",
+    ["endpoint"],
+)
+ENGINE_BUSY_SECONDS = Counter(
+    "processing_tools_engine_busy_seconds_total",
+    "Time the engine spent converting. Its rate is the engine's utilization.",
+    ["endpoint"],
+)
+ASSET_CACHE_REQUESTS = Counter(
+    "processing_tools_asset_cache_requests_total",
+    "Asset requests of rendered pages by origin host and cache result "
+    "(hit, miss, revalidated, stale, uncacheable, too_large, error).",
+    ["host", "result"],
+)
+ASSET_CACHE_BYTES = Gauge(
+    "processing_tools_asset_cache_bytes",
+    "Bytes of assets held in the asset cache.",
+)
+INPUT_FORMATS = Counter(
+    "processing_tools_input_formats_total",
+    "Downloaded inputs by the format detected from their content and what was "
+    "done with them (convert, passthrough, reject).",
+    ["endpoint", "format", "outcome"],
+)
+STARTUP_SECONDS = Gauge(
+    "processing_tools_startup_seconds",
+    "Time spent importing the app (import), and from the process start until "
+    "the app started (startup) and was warmed up (ready).",
+    ["phase"],
+)
+WARMUP_SECONDS = Gauge(
+    "processing_tools_warmup_seconds",
+    "Time the warm-up conversion of each engine took at startup.",
+    ["engine"],
+)
+LOOP_LAG_SECONDS = Histogram(
+    "processing_tools_event_loop_lag_seconds",
+    "How late the event loop woke up a sleeping task.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_BLOCKS = Counter(
+    "processing_tools_event_loop_blocks_total",
+    "Times the event loop was blocked for longer than the block threshold.",
+)
+CIRCUIT_STATE = Gauge(
+    "processing_tools_circuit_state",
+    "1 for the current state of the circuit breaker of a backend, 0 otherwise.",
+    ["backend", "state"],
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "processing_tools_circuit_transitions_total",
+    "Transitions of the circuit breaker of a backend into a state.",
+    ["backend", "state"],
+)
+BROWSERLESS_FALLBACKS = Counter(
+    "processing_tools_browserless_fallbacks_total",
+    "Browserless renders done by wkhtmltopdf because browserless was unavailable.",
+)
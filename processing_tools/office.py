@@ -1,39 +1,67 @@
-import asyncio
 import logging.config
 import os
 import subprocess
+import time
 from pathlib import Path
-from typing import Optional
 
+from starlette.concurrency import run_in_threadpool
+
+from processing_tools.libreoffice import LibreOfficePool
 from processing_tools.logging.config import get_doc_processing_log_extra
+from processing_tools.metrics import ENGINE_BUSY_SECONDS, ENGINE_WAIT_SECONDS
+from processing_tools.settings import settings
+from processing_tools.sniff import EXTENSION_FORMATS
 from processing_tools.types import OD_TO_PDF_ENDPOINT, FileConverter
 
 logger = logging.getLogger(__name__)
 
 
-lock = asyncio.Lock()
+pool = LibreOfficePool(
+    OD_TO_PDF_ENDPOINT, settings.libreoffice_workers, settings.libreoffice_profile_dir
+)
 
 
 class OfficeDocumentConverter(FileConverter):
-    async def convert(self, in_path: Path) -> bytes:
+    output_extension = "pdf"
+    input_formats = frozenset(
+        {
+            *("doc", "docx", "docm", "dotx", "dotm", "odt", "rtf", "txt"),
+            *("xls", "xlsx", "xlsm", "xlsb", "xltx", "xltm", "ods", "csv", "tsv"),
+            *("ppt", "pptx", "pptm", "ppsx", "ppsm", "potx", "potm", "odp"),
+            *("odg", "vsd", "vsdx", "vsdm", "pub", "wpd"),
+            *("png", "jpg", "gif", "tiff", "bmp", "webp"),
+            *EXTENSION_FORMATS,
+        }
+    )
+
+    async def convert(self, in_path: Path) -> Path:
         """
         Accepts on office file and converts it to a PDF using libreoffice.
+
+        Returns the path of the converted file, see `output_path`.
         """
 
-        out_path: Optional[str] = None
+        out_path = self.output_path(in_path)
 
-        async with lock:
+        t_queued = time.time()
+        async with pool.worker() as profile_args:
+            t_start = time.time()
+            ENGINE_WAIT_SECONDS.labels(OD_TO_PDF_ENDPOINT).observe(t_start - t_queued)
 
             try:
-                subprocess.run(
+                # run in a thread, so the event loop keeps serving other
+                # requests while libreoffice works
+                await run_in_threadpool(
+                    subprocess.run,
                     [
                         "libreoffice",
                         "--headless",
+                        *profile_args,
                         "--convert-to",
                         "pdf",
                         str(in_path.absolute()),
                         "--outdir",
-                        str(in_path.parent),
+                        str(out_path.parent),
                     ],
                     # combine stdout and stderr
                     stdout=subprocess.PIPE,
@@ -41,7 +69,8 @@ class OfficeDocumentConverter(FileConverter):
                     check=True,
                 )
 
-                out_path = str(list(in_path.parent.glob("*.pdf"))[0])
+                if not os.path.exists(out_path):
+                    raise FileNotFoundError(out_path)
 
             except subprocess.CalledProcessError as e:
                 extra = get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, self.meta)
@@ -51,11 +80,7 @@ class OfficeDocumentConverter(FileConverter):
                     self.__class__.__name__,
                     extra=extra,
                 )
-                if (
-                    not out_path
-                    or not os.path.exists(out_path)
-                    or not os.path.getsize(out_path)
-                ):
+                if not os.path.exists(out_path) or not os.path.getsize(out_path):
                     logger.error(
                         "%s: no file found at out_path",
                         self.__class__.__name__,
@@ -64,7 +89,7 @@ class OfficeDocumentConverter(FileConverter):
                         ),
                     )
                     raise e
-            except IndexError:
+            except FileNotFoundError:
                 logger.exception(
                     "%s: libreoffice - no pdf generated",
                     self.__class__.__name__,
@@ -78,8 +103,9 @@ class OfficeDocumentConverter(FileConverter):
                     extra=get_doc_processing_log_extra(OD_TO_PDF_ENDPOINT, self.meta),
                 )
                 raise
+            finally:
+                ENGINE_BUSY_SECONDS.labels(OD_TO_PDF_ENDPOINT).inc(
+                    time.time() - t_start
+                )
 
-        with open(out_path, "rb") as f:
-            response_bytes = f.read()
-
-        return response_bytes
+        return out_path
@@ -0,0 +1,171 @@
+import logging
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from processing_tools.logging.config import get_doc_processing_log_extra
+from processing_tools.metrics import (
+    PDF_OPTIMIZATION_SAVED_BYTES,
+    PDF_OPTIMIZATION_SECONDS,
+)
+from processing_tools.types import DocumentMeta, Endpoint, PDFOptimizeOptions
+from processing_tools.workspace import remove_job_files
+
+logger = logging.getLogger(__name__)
+
+
+# qpdf exits with 3 when it succeeded but had warnings, e.g. about a
+# slightly damaged input it could recover
+QPDF_EXIT_WARNINGS = 3
+
+
+class DamagedPDFError(Exception):
+    """
+    qpdf can't read the PDF, it would fail merging it too.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("damaged PDF")
+
+
+def check_pdf(path: Path) -> None:
+    """
+    Raise `DamagedPDFError` when qpdf finds errors in the PDF at `path` which it
+    can't recover from. Without qpdf the PDF isn't checked.
+    """
+    try:
+        subprocess.run(
+            ["qpdf", "--check", str(path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        if e.returncode != QPDF_EXIT_WARNINGS:
+            logger.warning(
+                "qpdf: checking a pdf failed: %s",
+                e.stdout.decode("utf-8", errors="replace"),
+            )
+            raise DamagedPDFError()
+    except OSError:
+        # e.g. qpdf isn't installed
+        logger.exception("qpdf: could not run it")
+
+
+def merge_pdfs(in_paths: Sequence[Path], out_path: Path) -> None:
+    """
+    Concatenate the pages of `in_paths`, in order, into a single PDF at `out_path`
+    using qpdf.
+    """
+    try:
+        subprocess.run(
+            [
+                "qpdf",
+                "--empty",
+                "--pages",
+                *[str(path) for path in in_paths],
+                "--",
+                str(out_path),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        if e.returncode != QPDF_EXIT_WARNINGS or not os.path.exists(out_path):
+            logger.error(
+                "qpdf: merging %d files failed: %s",
+                len(in_paths),
+                e.stdout.decode("utf-8", errors="replace"),
+            )
+            raise
+        logger.warning(
+            "qpdf: merged %d files with warnings: %s",
+            len(in_paths),
+            e.stdout.decode("utf-8", errors="replace"),
+        )
+
+
+def ghostscript_optimize_args(
+    in_path: Path, out_path: Path, options: PDFOptimizeOptions
+) -> List[str]:
+    args = [
+        "gs",
+        "-q",
+        "-dNOPAUSE",
+        "-dBATCH",
+        "-dSAFER",
+        "-sDEVICE=pdfwrite",
+        "-dCompatibilityLevel=1.5",
+        "-dCompressPages=true",
+        "-dCompressFonts=true",
+        "-dSubsetFonts=true",
+        "-dDetectDuplicateImages=true",
+    ]
+    if options.image_dpi:
+        for kind in ("Color", "Gray", "Mono"):
+            args += [
+                f"-dDownsample{kind}Images=true",
+                f"-d{kind}ImageResolution={options.image_dpi}",
+                # only touch images that are above the target resolution
+                f"-d{kind}ImageDownsampleThreshold=1.0",
+            ]
+    return args + [f"-sOutputFile={out_path}", str(in_path)]
+
+
+def optimize_pdf(
+    in_path: Path,
+    options: PDFOptimizeOptions,
+    endpoint: Endpoint,
+    meta: Optional[DocumentMeta],
+) -> Path:
+    """
+    Rewrite the PDF at `in_path` with ghostscript to make it smaller.
+
+    Returns the path of the smaller of the two files and removes the other one.
+    Optimization is best effort: if ghostscript fails, `in_path` is returned.
+    """
+    t_start = time.time()
+    out_path = in_path.with_name(f"{in_path.stem}-optimized.pdf")
+    try:
+        subprocess.run(
+            ghostscript_optimize_args(in_path, out_path, options),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        extra = get_doc_processing_log_extra(endpoint, meta)
+        extra["error_detail"] = e.stdout.decode("utf-8", errors="replace")
+        logger.exception("ghostscript: optimizing pdf failed", extra=extra)
+        remove_job_files(out_path)
+        return in_path
+    except OSError:
+        # e.g. ghostscript isn't installed
+        logger.exception(
+            "ghostscript: could not run it",
+            extra=get_doc_processing_log_extra(endpoint, meta),
+        )
+        remove_job_files(out_path)
+        return in_path
+
+    t_total = time.time() - t_start
+    size = os.path.getsize(in_path)
+    optimized_size = os.path.getsize(out_path)
+
+    PDF_OPTIMIZATION_SECONDS.labels(endpoint).observe(t_total)
+    PDF_OPTIMIZATION_SAVED_BYTES.labels(endpoint).inc(max(size - optimized_size, 0))
+
+    extra = get_doc_processing_log_extra(endpoint, meta)
+    extra["size_bytes"] = size
+    extra["optimized_size_bytes"] = optimized_size
+    extra["optimization_time"] = t_total
+    logger.info("pdf optimized", extra=extra)
+
+    if optimized_size < size:
+        remove_job_files(in_path)
+        return out_path
+    remove_job_files(out_path)
+    return in_path
@@ -0,0 +1,80 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from processing_tools.metrics import PREFETCH_BYTES, PREFETCH_JOBS
+
+
+class PrefetchSlot:
+    """
+    A job's place in a `PrefetchPool`, holding the bytes of its input.
+    """
+
+    def __init__(self, pool: "PrefetchPool"):
+        self.pool = pool
+        self.size = 0
+
+    async def reserve(self, size: int) -> None:
+        """
+        Wait until `size` more bytes fit in the pool's byte budget.
+        """
+        await self.pool._reserve(self, size)
+
+    def grow(self, size: int) -> None:
+        """
+        Account for `size` more bytes without waiting, e.g. when a download
+        turned out to be larger than announced.
+        """
+        self.pool._grow(self, size)
+
+
+class PrefetchPool:
+    """
+    Bounds the jobs that are downloading their input or holding a downloaded
+    input until the engine is done with it.
+
+    Downloads of queued jobs run ahead while the engine works on another job,
+    so the engine always has the next input on local disk. At most `max_jobs`
+    jobs and `max_bytes` bytes of input are held at once; a job larger than
+    `max_bytes` is let in when the pool is otherwise empty.
+
+    `max_jobs` includes the jobs in the engine, so it should be larger than
+    the number of jobs the engine runs at once.
+    """
+
+    def __init__(self, max_jobs: int, max_bytes: int):
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.jobs = 0
+        self.bytes = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[PrefetchSlot]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.jobs < self.max_jobs)
+            self.jobs += 1
+            PREFETCH_JOBS.inc()
+
+        slot = PrefetchSlot(self)
+        try:
+            yield slot
+        finally:
+            async with self._condition:
+                self.jobs -= 1
+                self.bytes -= slot.size
+                PREFETCH_JOBS.dec()
+                PREFETCH_BYTES.dec(slot.size)
+                self._condition.notify_all()
+
+    async def _reserve(self, slot: PrefetchSlot, size: int) -> None:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.bytes + size <= self.max_bytes or self.bytes == 0
+            )
+            self._grow(slot, size)
+
+    def _grow(self, slot: PrefetchSlot, size: int) -> None:
+        slot.size += size
+        self.bytes += size
+        PREFETCH_BYTES.inc(size)
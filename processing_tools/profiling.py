@@ -0,0 +1,298 @@
+"""
+Profiling of the running service, for finding out where the time goes when a
+conversion gets slow in production. Everything here is gated by the admin token,
+see `require_admin`.
+
+- `sample_stacks` samples the stacks of all threads of the worker for a while
+  and returns them as a speedscope profile (https://www.speedscope.app).
+- `ProfilingMiddleware` runs single requests under cProfile when asked to by the
+  `X-Profile` header or a `"profile": true` in the request's meta, and keeps the
+  results as pstats files in `RequestProfiles`.
+- `LoopMonitor` measures the lag of the event loop and records the stack of
+  the loop thread whenever something blocks it.
+"""
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import defaultdict, deque
+from pathlib import Path
+from types import FrameType
+from typing import Deque, Dict, List, Optional, Tuple
+
+from fastapi import Header, HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from processing_tools.metrics import LOOP_BLOCKS, LOOP_LAG_SECONDS
+from processing_tools.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "x-profile-id"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+# request bodies up to this size are checked for the meta flag
+MAX_PROFILE_FLAG_BODY_BYTES = 1024 * 1024
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(settings.admin_token) and hmac.compare_digest(
+        token or "", settings.admin_token
+    )
+
+
+def require_admin(x_admin_token: str = Header("")) -> None:
+    """
+    Dependency of the admin endpoints. They don't exist unless `ADMIN_TOKEN` is
+    set, and need it in the `X-Admin-Token` header.
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=404)
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403)
+
+
+def sample_stacks(seconds: float, interval: float) -> dict:
+    """
+    Sample the stacks of all other threads every `interval` seconds for
+    `seconds` seconds. Blocks the calling thread, so run it in a thread.
+
+    Returns a speedscope file with a sampled profile per thread. Samples are
+    weighted by wall-clock time, so threads waiting on a subprocess or a socket
+    show where they wait.
+    """
+    own_ident = threading.get_ident()
+    frames: List[dict] = []
+    frame_indexes: Dict[Tuple[str, str, int], int] = {}
+    samples: Dict[int, List[List[int]]] = defaultdict(list)
+    weights: Dict[int, List[float]] = defaultdict(list)
+
+    t_start = t_sample = time.perf_counter()
+    while t_sample - t_start < seconds:
+        time.sleep(interval)
+        t_previous, t_sample = t_sample, time.perf_counter()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            current: Optional[FrameType] = frame
+            while current is not None:
+                code = current.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                if key not in frame_indexes:
+                    frame_indexes[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                stack.append(frame_indexes[key])
+                current = current.f_back
+            stack.reverse()
+            samples[ident].append(stack)
+            weights[ident].append(t_sample - t_previous)
+
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"processing_tools pid {os.getpid()}",
+        "exporter": "processing_tools",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread_names.get(ident, str(ident)),
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights[ident]),
+                "samples": samples[ident],
+                "weights": weights[ident],
+            }
+            for ident in samples
+        ],
+    }
+
+
+class RequestProfiles:
+    """
+    The pstats files of the last `max_profiles` profiled requests.
+    """
+
+    def __init__(self, dir: str, max_profiles: int):
+        self.dir = Path(dir)
+        self.max_profiles = max_profiles
+        self.ids: Deque[str] = deque()
+
+    def save(self, profile_id: str, profiler: cProfile.Profile) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        profiler.dump_stats(self.dir / f"{profile_id}.pstats")
+        self.ids.append(profile_id)
+        while len(self.ids) > self.max_profiles:
+            (self.dir / f"{self.ids.popleft()}.pstats").unlink(missing_ok=True)
+
+    def path(self, profile_id: str) -> Optional[Path]:
+        if profile_id not in self.ids:
+            return None
+        return self.dir / f"{profile_id}.pstats"
+
+
+def _meta_profile_flag(body: bytes) -> bool:
+    try:
+        meta = json.loads(body).get("meta")
+    except (ValueError, AttributeError):
+        return False
+    return isinstance(meta, dict) and meta.get("profile") is True
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests of admins that ask for it under cProfile. The id of the
+    profile is returned in the `X-Profile-Id` header, see `RequestProfiles`.
+
+    cProfile only sees the event loop thread, which is where the request's
+    own code runs, but also the code of concurrent requests. Work the request
+    hands to the thread pool is not included; use `sample_stacks` for that.
+    Only one request is profiled at a time, others run as usual.
+    """
+
+    def __init__(self, app: ASGIApp, profiles: RequestProfiles):
+        self.app = app
+        self.profiles = profiles
+        self.active = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.admin_token:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if not is_admin(headers.get(ADMIN_TOKEN_HEADER)):
+            await self.app(scope, receive, send)
+            return
+
+        profile = headers.get(PROFILE_HEADER, "").lower() in ("1", "true")
+        content_length = headers.get("content-length", "")
+        if (
+            not profile
+            and scope["method"] == "POST"
+            and content_length.isdigit()
+            and int(content_length) <= MAX_PROFILE_FLAG_BODY_BYTES
+        ):
+            body, receive = await self._buffer_body(receive)
+            profile = _meta_profile_flag(body)
+
+        if not profile or self.active:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        self.active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            self.active = False
+            self.profiles.save(profile_id, profiler)
+            logger.info("profiled %s as %s", scope["path"], profile_id)
+
+    async def _buffer_body(self, receive: Receive) -> Tuple[bytes, Receive]:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay() -> Message:
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return body, replay
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping for `interval`
+    seconds, and records the stack of the loop thread when it was blocked for
+    more than `block_threshold` seconds, keeping the last `max_blocks` blocks.
+
+    The stack is taken by a watchdog thread while the loop is still blocked, so
+    it shows the code that blocks it.
+    """
+
+    def __init__(self, interval: float, block_threshold: float, max_blocks: int):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.blocks: Deque[dict] = deque(maxlen=max_blocks)
+        self.last_beat = time.perf_counter()
+        self.loop_thread_ident: Optional[int] = None
+        self._stack: Optional[List[str]] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self.loop_thread_ident = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            t_sleep = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(now - t_sleep - self.interval, 0.0)
+            LOOP_LAG_SECONDS.observe(lag)
+
+            with self._lock:
+                stack, self._stack = self._stack, None
+                self.last_beat = now
+            if lag >= self.block_threshold:
+                LOOP_BLOCKS.inc()
+                self.blocks.append(
+                    {
+                        "ended_at": time.time(),
+                        "duration": lag,
+                        "stack": stack or [],
+                    }
+                )
+                logger.warning(
+                    "event loop was blocked for %.3fs:\n%s", lag, "".join(stack or [])
+                )
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                blocked_for = time.perf_counter() - self.last_beat - self.interval
+                if self._stack is not None or blocked_for < self.block_threshold:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread_ident or 0)
+                if frame is not None:
+                    self._stack = traceback.format_stack(frame)
@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    Callable,
+    Deque,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from processing_tools.metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CircuitState = Literal["closed", "open", "half_open"]
+CIRCUIT_STATES: Tuple[CircuitState, ...] = ("closed", "open", "half_open")
+
+
+class CircuitOpenError(Exception):
+    """
+    The circuit breaker of a backend doesn't let calls through.
+    """
+
+
+class AttemptsFailedError(Exception):
+    """
+    Every attempt of a `hedged_call` failed.
+    """
+
+    def __init__(self, errors: List[BaseException]):
+        super().__init__(f"all {len(errors)} attempts failed: {errors}")
+        self.errors = errors
+
+
+class CircuitBreaker:
+    """
+    Stops calling a backend that fails or is slow.
+
+    The outcomes of the last `window` calls are kept. Once at least `min_calls`
+    are known, the circuit opens when the share of failed calls reaches
+    `error_ratio` or the share of calls taking `slow_call_seconds` or longer
+    reaches `slow_call_ratio`. While open, `allow` refuses calls. After
+    `open_seconds` the circuit is half open and lets a single trial call
+    through, which closes it again if it succeeds in time and opens it otherwise.
+
+    Thread safe. State transitions are exported as metrics labelled `name`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_calls: int,
+        error_ratio: float,
+        slow_call_seconds: float,
+        slow_call_ratio: float,
+        open_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_ratio = error_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_ratio = slow_call_ratio
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state: CircuitState = "closed"
+        # (failed, slow) of the last calls
+        self.outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._export_state()
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through. Every allowed call must be followed by
+        a `record` of its outcome.
+        """
+        with self._lock:
+            if (
+                self.state == "open"
+                and self.clock() - self.opened_at >= self.open_seconds
+            ):
+                self._transition("half_open")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool, seconds: float) -> None:
+        slow = bool(self.slow_call_seconds) and seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_in_flight = False
+                self._transition("closed" if ok and not slow else "open")
+                return
+            if self.state == "open":
+                # a call that started before the circuit opened
+                return
+
+            self.outcomes.append((not ok, slow))
+            if len(self.outcomes) < self.min_calls:
+                return
+            failed = sum(failed for failed, _ in self.outcomes) / len(self.outcomes)
+            slow_calls = sum(slow for _, slow in self.outcomes) / len(self.outcomes)
+            if failed >= self.error_ratio or (
+                self.slow_call_ratio and slow_calls >= self.slow_call_ratio
+            ):
+                self._transition("open")
+
+    def _transition(self, state: CircuitState) -> None:
+        logger.warning("circuit %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        self.outcomes.clear()
+        if state == "open":
+            self.opened_at = self.clock()
+        CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+        self._export_state()
+
+    def _export_state(self) -> None:
+        for state in CIRCUIT_STATES:
+            CIRCUIT_STATE.labels(self.name, state).set(int(state == self.state))
+
+
+def _discarding(discard: Callable[[T], None]) -> Callable[["Future[T]"], None]:
+    def callback(future: "Future[T]") -> None:
+        if future.exception() is None:
+            discard(future.result())
+
+    return callback
+
+
+def hedged_call(
+    attempts: Sequence[Callable[[], T]],
+    hedge_after: float,
+    discard: Optional[Callable[[T], None]] = None,
+) -> T:
+    """
+    Call `attempts` one after the other until one succeeds, and return its
+    result.
+
+    The next attempt is started when the running ones failed, or, if
+    `hedge_after` is set, when they took longer than `hedge_after` seconds;
+    then the first attempt to succeed wins. `discard` is called on the results
+    of attempts that succeed after another one won. Raises `AttemptsFailedError`
+    when every attempt failed.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(attempts))
+    pending: Set["Future[T]"] = set()
+    errors: List[BaseException] = []
+    remaining = list(attempts)
+    try:
+        while remaining or pending:
+            if remaining and (not pending or hedge_after):
+                pending.add(executor.submit(remaining.pop(0)))
+            done, pending = wait(
+                pending,
+                timeout=hedge_after if remaining and hedge_after else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if discard:
+                        for loser in pending:
+                            loser.add_done_callback(_discarding(discard))
+                    return future.result()
+                errors.append(error)
+        raise AttemptsFailedError(errors)
+    finally:
+        executor.shutdown(wait=False)
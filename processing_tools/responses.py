@@ -0,0 +1,75 @@
+import os
+
+import anyio
+from fastapi.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+# ASGI extensions that let the server send a file without it passing through
+# python. "pathsend" hands over the path, "zerocopy" an open file which the
+# server writes to the socket with sendfile.
+PATHSEND_EXTENSION = "http.response.pathsend"
+ZEROCOPY_EXTENSION = "http.response.zerocopy"
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """
+    Serve a converted file from disk.
+
+    When the ASGI server supports the pathsend or zerocopy extension the file is
+    handed to the server, which sends it with `sendfile`, so the bytes never enter
+    userspace. Otherwise it is streamed in large chunks.
+
+    Unlike `FileResponse`, the background task also runs when sending fails
+    (e.g. the client went away), so it can be relied on to clean up the file.
+    """
+
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.send_file(scope, send)
+        finally:
+            if self.background is not None:
+                await self.background()
+
+    async def send_file(self, scope: Scope, send: Send) -> None:
+        if self.stat_result is None:
+            self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+
+        extensions = scope.get("extensions") or {}
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif PATHSEND_EXTENSION in extensions:
+            await send({"type": PATHSEND_EXTENSION, "path": str(self.path)})
+        elif ZEROCOPY_EXTENSION in extensions:
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": file,
+                        "count": self.stat_result.st_size,
+                        "more_body": False,
+                    }
+                )
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                more_body = True
+                while more_body:
+                    chunk = await file.read(self.chunk_size)
+                    more_body = len(chunk) == self.chunk_size
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": more_body,
+                        }
+                    )
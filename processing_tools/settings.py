@@ -1,10 +1,13 @@
 import os
+import secrets
+import tempfile
 
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     debug: bool = bool(os.environ.get("DEBUG", False))
+    # a comma separated list of browserless endpoints, tried in order
     browserless_server_endpoint: str = os.environ.get(
         "BROWSERLESS_SERVER_ENDPOINT_URL", "http://localhost:3000"
     )
@@ -12,6 +15,165 @@ class Settings(BaseSettings):
     iter_chunk_size: int = 512
     environment: str = os.environ.get("ENVIRONMENT", "local")
 
+    # Shared working directory for conversion jobs. Files older than
+    # `work_file_max_age` seconds are considered orphaned and are removed
+    # every `work_sweep_interval` seconds.
+    work_dir: str = os.environ.get(
+        "WORK_DIR", os.path.join(tempfile.gettempdir(), "processing_tools")
+    )
+    work_file_max_age: float = float(os.environ.get("WORK_FILE_MAX_AGE", 60 * 60))
+    work_sweep_interval: float = float(os.environ.get("WORK_SWEEP_INTERVAL", 5 * 60))
+
+    # Jobs with inputs of at most `scratch_memory_max_file_bytes` run in a
+    # memory-backed directory while the total bytes reserved there stay within
+    # `scratch_memory_budget_bytes`. Other jobs spill to `work_dir`.
+    # Set SCRATCH_MEMORY_DIR to an empty string to always use `work_dir`.
+    scratch_memory_dir: str = os.environ.get(
+        "SCRATCH_MEMORY_DIR", "/dev/shm/processing_tools"
+    )
+    scratch_memory_max_file_bytes: int = int(
+        os.environ.get("SCRATCH_MEMORY_MAX_FILE_BYTES", 8 * 1024 * 1024)
+    )
+    scratch_memory_budget_bytes: int = int(
+        os.environ.get("SCRATCH_MEMORY_BUDGET_BYTES", 48 * 1024 * 1024)
+    )
+
+    # Inputs for libreoffice are downloaded ahead while it converts other jobs.
+    # For each endpoint, at most `prefetch_max_jobs` jobs (including the ones
+    # being converted, at least one more than `libreoffice_workers`) and
+    # `prefetch_max_bytes` bytes of input are held at once. Downloads without a
+    # Content-Length count as `prefetch_unknown_size_bytes` until they are done.
+    prefetch_max_jobs: int = int(os.environ.get("PREFETCH_MAX_JOBS", 4))
+    prefetch_max_bytes: int = int(
+        os.environ.get("PREFETCH_MAX_BYTES", 512 * 1024 * 1024)
+    )
+    prefetch_unknown_size_bytes: int = int(
+        os.environ.get("PREFETCH_UNKNOWN_SIZE_BYTES", 8 * 1024 * 1024)
+    )
+
+    # Each libreoffice endpoint runs up to `libreoffice_workers` conversions at
+    # once. Every worker keeps its own profile in `libreoffice_profile_dir`,
+    # which must not be under `work_dir`.
+    libreoffice_workers: int = int(os.environ.get("LIBREOFFICE_WORKERS", 1))
+    libreoffice_profile_dir: str = os.environ.get(
+        "LIBREOFFICE_PROFILE_DIR",
+        os.path.join(tempfile.gettempdir(), "processing_tools_libreoffice"),
+    )
+
+    # Archives sent to /archive_to_pdf/ may have at most `archive_max_members`
+    # files with at most `archive_max_uncompressed_bytes` bytes in total.
+    archive_max_members: int = int(os.environ.get("ARCHIVE_MAX_MEMBERS", 100))
+    archive_max_uncompressed_bytes: int = int(
+        os.environ.get("ARCHIVE_MAX_UNCOMPRESSED_BYTES", 512 * 1024 * 1024)
+    )
+
+    # HTML pages of at least `html_split_min_bytes` are rendered by wkhtmltopdf
+    # in up to `html_split_max_sections` concurrent sections which are merged
+    # into one PDF. 0 disables splitting.
+    html_split_min_bytes: int = int(os.environ.get("HTML_SPLIT_MIN_BYTES", 0))
+    html_split_max_sections: int = int(
+        os.environ.get("HTML_SPLIT_MAX_SECTIONS", os.cpu_count() or 1)
+    )
+
+    # Seconds to wait for browserless to accept a connection and between bytes
+    # of its response. With `browserless_hedge_after` set, a render that took
+    # longer than that is also sent to the next endpoint and the first answer
+    # wins.
+    browserless_connect_timeout: float = float(
+        os.environ.get("BROWSERLESS_CONNECT_TIMEOUT", 5)
+    )
+    browserless_read_timeout: float = float(
+        os.environ.get("BROWSERLESS_READ_TIMEOUT", 120)
+    )
+    browserless_hedge_after: float = float(os.environ.get("BROWSERLESS_HEDGE_AFTER", 0))
+    # The circuit of an endpoint opens when at least `browserless_breaker_error_ratio`
+    # of its last `browserless_breaker_window` renders failed, or at least
+    # `browserless_breaker_slow_ratio` of them took `browserless_breaker_slow_seconds`
+    # or longer. It is retried after `browserless_breaker_open_seconds`. While all
+    # circuits are open, renders fall back to wkhtmltopdf unless disabled.
+    browserless_breaker_window: int = int(
+        os.environ.get("BROWSERLESS_BREAKER_WINDOW", 20)
+    )
+    browserless_breaker_min_calls: int = int(
+        os.environ.get("BROWSERLESS_BREAKER_MIN_CALLS", 5)
+    )
+    browserless_breaker_error_ratio: float = float(
+        os.environ.get("BROWSERLESS_BREAKER_ERROR_RATIO", 0.5)
+    )
+    browserless_breaker_slow_seconds: float = float(
+        os.environ.get("BROWSERLESS_BREAKER_SLOW_SECONDS", 60)
+    )
+    browserless_breaker_slow_ratio: float = float(
+        os.environ.get("BROWSERLESS_BREAKER_SLOW_RATIO", 0.5)
+    )
+    browserless_breaker_open_seconds: float = float(
+        os.environ.get("BROWSERLESS_BREAKER_OPEN_SECONDS", 30)
+    )
+    browserless_fallback_enabled: bool = (
+        os.environ.get("BROWSERLESS_FALLBACK_ENABLED", "1") != "0"
+    )
+
+    # Assets (stylesheets, fonts, images, ...) of rendered pages are served from
+    # a local cache of at most `asset_cache_max_bytes` through `/asset-cache/`.
+    # Renderers reach this service at `asset_cache_local_url` (wkhtmltopdf) and
+    # `asset_cache_public_url` (browserless). With the cache enabled, browserless
+    # renders the rewritten page's HTML instead of loading the url itself.
+    asset_cache_enabled: bool = bool(os.environ.get("ASSET_CACHE_ENABLED", False))
+    asset_cache_dir: str = os.environ.get(
+        "ASSET_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "processing_tools_assets"),
+    )
+    asset_cache_max_bytes: int = int(
+        os.environ.get("ASSET_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+    )
+    asset_cache_max_asset_bytes: int = int(
+        os.environ.get("ASSET_CACHE_MAX_ASSET_BYTES", 32 * 1024 * 1024)
+    )
+    # assets without caching headers are kept for `asset_cache_default_ttl` seconds
+    asset_cache_default_ttl: float = float(
+        os.environ.get("ASSET_CACHE_DEFAULT_TTL", 60 * 60)
+    )
+    asset_cache_timeout: float = float(os.environ.get("ASSET_CACHE_TIMEOUT", 30))
+    asset_cache_local_url: str = os.environ.get(
+        "ASSET_CACHE_LOCAL_URL", "http://127.0.0.1:8080"
+    )
+    asset_cache_public_url: str = os.environ.get(
+        "ASSET_CACHE_PUBLIC_URL", asset_cache_local_url
+    )
+    # threads serving `/asset-cache/`, separate from the thread pool in which
+    # renders wait for their assets
+    asset_cache_threads: int = int(os.environ.get("ASSET_CACHE_THREADS", 16))
+    # signs the proxied urls, random unless shared between instances
+    asset_cache_secret: str = os.environ.get(
+        "ASSET_CACHE_SECRET", secrets.token_hex(32)
+    )
+
+    # Each engine converts a sample from `warmup_files_dir` at startup, `/ready`
+    # answers 200 once all of them are done or took `warmup_timeout` seconds.
+    warmup_enabled: bool = os.environ.get("WARMUP_ENABLED", "1") != "0"
+    warmup_files_dir: str = os.environ.get("WARMUP_FILES_DIR", "tests/files")
+    warmup_timeout: float = float(os.environ.get("WARMUP_TIMEOUT", 120))
+
+    # Admin endpoints (`/admin/...`) need this token in the `X-Admin-Token`
+    # header, they are disabled while it is empty.
+    admin_token: str = os.environ.get("ADMIN_TOKEN", "")
+    # pstats files of the last `profiling_max_request_profiles` profiled requests
+    # are kept in `profiling_dir`. Stack sampling runs for `profiling_max_seconds`
+    # at most.
+    profiling_dir: str = os.environ.get(
+        "PROFILING_DIR",
+        os.path.join(tempfile.gettempdir(), "processing_tools_profiles"),
+    )
+    profiling_max_request_profiles: int = int(
+        os.environ.get("PROFILING_MAX_REQUEST_PROFILES", 20)
+    )
+    profiling_max_seconds: float = float(os.environ.get("PROFILING_MAX_SECONDS", 300))
+    # The event loop lag is measured every `loop_monitor_interval` seconds, blocks
+    # of more than `loop_block_threshold` seconds are recorded with their stack.
+    # An interval of 0 disables the monitor.
+    loop_monitor_interval: float = float(os.environ.get("LOOP_MONITOR_INTERVAL", 0.1))
+    loop_block_threshold: float = float(os.environ.get("LOOP_BLOCK_THRESHOLD", 0.5))
+
     # Sentry config
     sentry_dsn: str = os.environ.get("SENTRY_DSN", "")
     git_sha: str = os.environ.get("GIT_SHA", "local")
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+from processing_tools.metrics import COALESCED_REQUESTS
+from processing_tools.types import Endpoint
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Flight(Generic[T]):
+    """
+    A call shared by every request that asked for it while it was in flight.
+
+    Every caller holds a reference and must `release` it once it is done with
+    the result. `cleanup` runs on the result when the last reference is
+    released, or when the call finishes after all callers went away.
+    """
+
+    def __init__(
+        self,
+        task: "asyncio.Task[T]",
+        cleanup: Optional[Callable[[T], None]],
+    ):
+        self.task = task
+        self.cleanup = cleanup
+        self.references = 0
+        self.task.add_done_callback(self._done)
+
+    @property
+    def result(self) -> T:
+        return self.task.result()
+
+    def acquire(self) -> None:
+        self.references += 1
+
+    def release(self) -> None:
+        self.references -= 1
+        if not self.references and self.task.done():
+            self._cleanup()
+
+    def _done(self, task: "asyncio.Task[T]") -> None:
+        # retrieve the exception so asyncio doesn't log it as never retrieved,
+        # the callers log it themselves
+        if not task.cancelled():
+            task.exception()
+        if not self.references:
+            self._cleanup()
+
+    def _cleanup(self) -> None:
+        if self.cleanup is None or self.task.cancelled() or self.task.exception():
+            return
+        try:
+            self.cleanup(self.task.result())
+        except Exception:
+            logger.exception("cleaning up after a coalesced call failed")
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent identical calls: the first caller for a key starts the
+    call, callers arriving while it is in flight wait for the same result or
+    exception instead of doing the work again.
+
+    Usage:
+    ```
+    flight = await single_flight.do(key, lambda: convert(url), cleanup=remove)
+    try:
+        ... use flight.result ...
+    finally:
+        flight.release()
+    ```
+    """
+
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.flights: Dict[Hashable, Flight[T]] = {}
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[T]],
+        cleanup: Optional[Callable[[T], None]] = None,
+    ) -> Flight[T]:
+        flight = self.flights.get(key)
+        if flight is None:
+            # run the call in its own task, so it isn't cancelled when the
+            # request that started it goes away while others are waiting
+            flight = Flight(asyncio.ensure_future(fn()), cleanup)
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            COALESCED_REQUESTS.labels(self.endpoint).inc()
+
+        flight.acquire()
+        try:
+            await asyncio.shield(flight.task)
+        except BaseException:
+            flight.release()
+            raise
+        return flight
+
+    def _forget(self, key: Hashable, flight: Flight[T]) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
@@ -0,0 +1,239 @@
+"""
+Detect the format of downloaded inputs from their content rather than their url.
+
+Formats are named by their usual file extension, which is what libreoffice uses
+to pick an import filter.
+"""
+import os
+import re
+import struct
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional
+
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+
+# OLE2 (compound file) streams identifying the application that wrote the file
+OLE2_STREAM_FORMATS = {
+    "WordDocument": "doc",
+    "Workbook": "xls",
+    "Book": "xls",
+    "PowerPoint Document": "ppt",
+    "VisioDocument": "vsd",
+    "Quill": "pub",
+    # an OOXML file encrypted with a password, which can't be converted
+    "EncryptedPackage": "encrypted",
+}
+OLE2_END_OF_CHAIN = 0xFFFFFFFE
+# bounds walking the sector chains of corrupt files
+OLE2_MAX_SECTORS = 1 << 16
+
+# the content type of the main part in [Content_Types].xml tells the plain
+# documents from macro-enabled, binary and template variants
+OOXML_PREFIX = "application/vnd.openxmlformats-officedocument."
+OOXML_CONTENT_TYPE_FORMATS = {
+    OOXML_PREFIX + "wordprocessingml.document.main+xml": "docx",
+    OOXML_PREFIX + "wordprocessingml.template.main+xml": "dotx",
+    "application/vnd.ms-word.document.macroEnabled.main+xml": "docm",
+    "application/vnd.ms-word.template.macroEnabledTemplate.main+xml": "dotm",
+    OOXML_PREFIX + "spreadsheetml.sheet.main+xml": "xlsx",
+    OOXML_PREFIX + "spreadsheetml.template.main+xml": "xltx",
+    "application/vnd.ms-excel.sheet.macroEnabled.main+xml": "xlsm",
+    "application/vnd.ms-excel.template.macroEnabled.main+xml": "xltm",
+    "application/vnd.ms-excel.sheet.binary.macroEnabled.main": "xlsb",
+    OOXML_PREFIX + "presentationml.presentation.main+xml": "pptx",
+    OOXML_PREFIX + "presentationml.slideshow.main+xml": "ppsx",
+    OOXML_PREFIX + "presentationml.template.main+xml": "potx",
+    "application/vnd.ms-visio.drawing.main+xml": "vsdx",
+    "application/vnd.ms-visio.drawing.macroEnabled.main+xml": "vsdm",
+    "application/vnd.ms-powerpoint.presentation.macroEnabled.main+xml": "pptm",
+    "application/vnd.ms-powerpoint.slideshow.macroEnabled.main+xml": "ppsm",
+    "application/vnd.ms-powerpoint.template.macroEnabled.main+xml": "potm",
+}
+OOXML_CONTENT_TYPE_RE = re.compile(rb"""ContentType\s*=\s*["']([^"']+)["']""")
+# bounds reading [Content_Types].xml, which lists a few entries per part
+OOXML_CONTENT_TYPES_MAX_BYTES = 1024 * 1024
+
+ODF_MIMETYPE_PREFIX = "application/vnd.oasis.opendocument."
+ODF_MIMETYPE_FORMATS = {
+    "text": "odt",
+    "spreadsheet": "ods",
+    "presentation": "odp",
+    "graphics": "odg",
+}
+
+MAGIC_FORMATS = [
+    (b"{\\rtf", "rtf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\xffWPC", "wpd"),
+]
+# "BM" alone also starts text, bitmaps are told by the size of their header
+BMP_MAGIC = b"BM"
+BMP_HEADER_SIZES = {12, 40, 52, 56, 64, 108, 124}
+# RIFF containers tell their format at offset 8
+RIFF_MAGIC = b"RIFF"
+RIFF_FORMATS = {b"WEBP": "webp"}
+
+# plain text formats have no signature, they are trusted by their extension
+TEXT_FORMATS = {"txt", "csv", "tsv"}
+# Other formats libreoffice opens, e.g. flat XML documents, vector images and
+# older office formats, have no signature checked here. When nothing else
+# matched, they are trusted by their extension and libreoffice's own type
+# detection has the last word.
+EXTENSION_FORMATS = {
+    *("fodt", "fods", "fodp", "fodg", "svg", "svgz", "emf", "wmf", "eps"),
+    *("wps", "wk1", "wks", "wb2", "dbf", "slk", "dif", "sxw", "sxc", "sxi", "sxd"),
+    *("pcx", "tga", "ppm", "pgm", "pbm", "xbm", "xpm", "ras", "psd"),
+}
+
+SNIFF_BYTES = 1024
+
+
+class UnsupportedFormatError(Exception):
+    """
+    The input is not in a format the endpoint can convert.
+    """
+
+    def __init__(self, file_format: Optional[str]):
+        super().__init__(f"unsupported input format: {file_format or 'unknown'}")
+        self.file_format = file_format
+
+
+def _ole2_directory_names(f: BinaryIO) -> Iterator[str]:
+    """
+    The names of the entries of the compound file `f`, see [MS-CFB].
+    """
+    header = f.read(512)
+    sector_shift = struct.unpack_from("<H", header, 0x1E)[0]
+    if not 7 <= sector_shift <= 16:
+        raise ValueError(f"invalid sector shift {sector_shift}")
+    sector_size = 1 << sector_shift
+    first_directory_sector = struct.unpack_from("<I", header, 0x30)[0]
+    first_difat_sector, difat_sectors = struct.unpack_from("<2I", header, 0x44)
+
+    def read_sector(sector: int) -> bytes:
+        f.seek((sector + 1) * sector_size)
+        data = f.read(sector_size)
+        if len(data) != sector_size:
+            raise ValueError(f"sector {sector} out of range")
+        return data
+
+    fat_sectors: List[int] = list(struct.unpack_from("<109I", header, 0x4C))
+    sector = first_difat_sector
+    for _ in range(min(difat_sectors, OLE2_MAX_SECTORS)):
+        data = read_sector(sector)
+        *entries, sector = struct.unpack(f"<{sector_size // 4}I", data)
+        fat_sectors += entries
+
+    entries_per_sector = sector_size // 4
+
+    def next_sector(sector: int) -> int:
+        fat_sector = read_sector(fat_sectors[sector // entries_per_sector])
+        offset = (sector % entries_per_sector) * 4
+        return struct.unpack_from("<I", fat_sector, offset)[0]
+
+    sector = first_directory_sector
+    for _ in range(OLE2_MAX_SECTORS):
+        if sector == OLE2_END_OF_CHAIN:
+            return
+        data = read_sector(sector)
+        for offset in range(0, sector_size, 128):
+            name_length = struct.unpack_from("<H", data, offset + 64)[0]
+            if 2 <= name_length <= 64:
+                yield data[offset : offset + name_length - 2].decode(
+                    "utf-16-le", errors="replace"
+                )
+        sector = next_sector(sector)
+
+
+def _sniff_ole2(f: BinaryIO) -> Optional[str]:
+    try:
+        for name in _ole2_directory_names(f):
+            if name in OLE2_STREAM_FORMATS:
+                return OLE2_STREAM_FORMATS[name]
+    except (ValueError, IndexError, struct.error):
+        return None
+    return None
+
+
+def _sniff_zip(path: Path) -> Optional[str]:
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            if "mimetype" in names:
+                mimetype = archive.read("mimetype").decode("ascii", errors="replace")
+                if mimetype.startswith(ODF_MIMETYPE_PREFIX):
+                    kind = mimetype[len(ODF_MIMETYPE_PREFIX) :].split("-")[0]
+                    return ODF_MIMETYPE_FORMATS.get(kind)
+            if "[Content_Types].xml" in names:
+                with archive.open("[Content_Types].xml") as f:
+                    content_types = f.read(OOXML_CONTENT_TYPES_MAX_BYTES)
+                for content_type in OOXML_CONTENT_TYPE_RE.findall(content_types):
+                    file_format = OOXML_CONTENT_TYPE_FORMATS.get(
+                        content_type.decode("ascii", errors="replace")
+                    )
+                    if file_format:
+                        return file_format
+                return None
+            if "mimetype" not in names:
+                # a plain archive of other files
+                return "zip"
+    except (zipfile.BadZipFile, OSError):
+        return None
+    return None
+
+
+def _looks_like_html(head: bytes) -> bool:
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    return text.startswith(b"<!doctype html") or b"<html" in text
+
+
+def _sniff_content(path: Path, extension: str) -> Optional[str]:
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+        if head.startswith(OLE2_MAGIC):
+            f.seek(0)
+            return _sniff_ole2(f)
+
+    if not head:
+        return None
+    if head.startswith(ZIP_MAGIC):
+        return _sniff_zip(path)
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"%PDF-"):
+        return "pdf"
+    for magic, file_format in MAGIC_FORMATS:
+        if head.startswith(magic):
+            return file_format
+    if (
+        head.startswith(BMP_MAGIC)
+        and len(head) >= 18
+        and struct.unpack_from("<I", head, 14)[0] in BMP_HEADER_SIZES
+    ):
+        return "bmp"
+    if head.startswith(RIFF_MAGIC) and head[8:12] in RIFF_FORMATS:
+        return RIFF_FORMATS[head[8:12]]
+    if _looks_like_html(head):
+        return "html"
+    if extension in TEXT_FORMATS and b"\x00" not in head:
+        return extension
+    return None
+
+
+def sniff_format(path: Path, extension: str = "") -> Optional[str]:
+    """
+    The format of the file at `path`, e.g. "docx" or "pdf", or None if it isn't
+    recognized or is corrupt. `extension` is the extension the file was named
+    with, which is only trusted for plain text formats and, when the content
+    matches no other format, for `EXTENSION_FORMATS`.
+    """
+    file_format = _sniff_content(path, extension)
+    if file_format is None and extension in EXTENSION_FORMATS:
+        if os.path.getsize(path) > 0:
+            return extension
+    return file_format
@@ -1,39 +1,62 @@
-import asyncio
 import logging.config
 import os
 import subprocess
+import time
 from pathlib import Path
-from typing import Optional
 
+from starlette.concurrency import run_in_threadpool
+
+from processing_tools.libreoffice import LibreOfficePool
 from processing_tools.logging.config import get_doc_processing_log_extra
+from processing_tools.metrics import ENGINE_BUSY_SECONDS, ENGINE_WAIT_SECONDS
+from processing_tools.settings import settings
 from processing_tools.types import XLS_TO_XLSX_ENDPOINT, FileConverter
 
 logger = logging.getLogger(__name__)
 
 
-lock = asyncio.Lock()
+pool = LibreOfficePool(
+    XLS_TO_XLSX_ENDPOINT, settings.libreoffice_workers, settings.libreoffice_profile_dir
+)
 
 
 class XLSToXLSXConverter(FileConverter):
-    async def convert(self, in_path: Path) -> bytes:
+    output_extension = "xlsx"
+    input_formats = frozenset(
+        {
+            *("xls", "xlsm", "xlsb", "xltx", "xltm", "ods", "csv", "tsv"),
+            *("fods", "sxc", "wk1", "wks", "wb2", "dbf", "slk", "dif"),
+        }
+    )
+
+    async def convert(self, in_path: Path) -> Path:
         """
         Accepts on xls file and converts it to a xlsx using libreoffice.
+
+        Returns the path of the converted file, see `output_path`.
         """
 
-        out_path: Optional[str] = None
+        out_path = self.output_path(in_path)
 
-        async with lock:
+        t_queued = time.time()
+        async with pool.worker() as profile_args:
+            t_start = time.time()
+            ENGINE_WAIT_SECONDS.labels(XLS_TO_XLSX_ENDPOINT).observe(t_start - t_queued)
 
             try:
-                subprocess.run(
+                # run in a thread, so the event loop keeps serving other
+                # requests while libreoffice works
+                await run_in_threadpool(
+                    subprocess.run,
                     [
                         "libreoffice",
                         "--headless",
+                        *profile_args,
                         "--convert-to",
                         "xlsx",
                         str(in_path.absolute()),
                         "--outdir",
-                        str(in_path.parent),
+                        str(out_path.parent),
                     ],
                     # combine stdout and stderr
                     stdout=subprocess.PIPE,
@@ -41,7 +64,8 @@ class XLSToXLSXConverter(FileConverter):
                     check=True,
                 )
 
-                out_path = str(list(in_path.parent.glob("*.xlsx"))[0])
+                if not os.path.exists(out_path):
+                    raise FileNotFoundError(out_path)
 
             except subprocess.CalledProcessError as e:
                 extra = get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, self.meta)
@@ -51,11 +75,7 @@ class XLSToXLSXConverter(FileConverter):
                     self.__class__.__name__,
                     extra=extra,
                 )
-                if (
-                    not out_path
-                    or not os.path.exists(out_path)
-                    or not os.path.getsize(out_path)
-                ):
+                if not os.path.exists(out_path) or not os.path.getsize(out_path):
                     logger.error(
                         "%s: no file found at out_path",
                         self.__class__.__name__,
@@ -64,7 +84,7 @@ class XLSToXLSXConverter(FileConverter):
                         ),
                     )
                     raise e
-            except IndexError:
+            except FileNotFoundError:
                 logger.exception(
                     "%s: libreoffice - no xlsx generated",
                     self.__class__.__name__,
@@ -78,8 +98,9 @@ class XLSToXLSXConverter(FileConverter):
                     extra=get_doc_processing_log_extra(XLS_TO_XLSX_ENDPOINT, self.meta),
                 )
                 raise
+            finally:
+                ENGINE_BUSY_SECONDS.labels(XLS_TO_XLSX_ENDPOINT).inc(
+                    time.time() - t_start
+                )
 
-        with open(out_path, "rb") as f:
-            response_bytes = f.read()
-
-        return response_bytes
+        return out_path
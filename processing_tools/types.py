@@ -1,19 +1,47 @@
 from pathlib import Path
-from typing import Literal, Optional, TypedDict
+from typing import FrozenSet, Literal, Optional, TypedDict
 
-from pydantic import AnyHttpUrl
+from pydantic import AnyHttpUrl, BaseModel, PositiveInt
 
+from processing_tools.workspace import job_output_path
 
-class DocumentMeta(TypedDict):
+
+class DocumentMetaBase(TypedDict):
     source_id: Optional[int]
     document_id: Optional[int]
 
 
+class DocumentMeta(DocumentMetaBase, total=False):
+    # profile the request, see `processing_tools.profiling`
+    profile: bool
+
+
+class PDFOptimizeOptions(BaseModel):
+    """
+    Post-process a converted PDF to make it smaller: streams are recompressed,
+    fonts and images are deduplicated and fonts are subset. When `image_dpi` is
+    set, images with a higher resolution are downsampled to it.
+    """
+
+    image_dpi: Optional[PositiveInt] = None
+
+
 class FileConverter:
+    output_extension: str
+    # the formats `convert` accepts, see `processing_tools.sniff`. Inputs that
+    # already are in the `output_extension` format are passed through.
+    input_formats: FrozenSet[str]
+
     def __init__(self, meta: Optional[DocumentMeta]):
         self.meta = meta
 
-    def convert(self, path: Path):
+    def output_path(self, in_path: Path) -> Path:
+        """
+        The known path `convert` writes its result for `in_path` to.
+        """
+        return job_output_path(in_path, self.output_extension)
+
+    async def convert(self, path: Path) -> Path:
         raise NotImplementedError("Subclasses must implement this")
 
 
@@ -25,7 +53,8 @@ class UrlConverter:
         raise NotImplementedError("Subclasses must implement this")
 
 
-Endpoint = Literal["od_to_pdf", "html_to_pdf", "xls_to_xlsx"]
+Endpoint = Literal["od_to_pdf", "html_to_pdf", "xls_to_xlsx", "archive_to_pdf"]
 OD_TO_PDF_ENDPOINT: Endpoint = "od_to_pdf"
 HTML_TO_PDF_ENDPOINT: Endpoint = "html_to_pdf"
 XLS_TO_XLSX_ENDPOINT: Endpoint = "xls_to_xlsx"
+ARCHIVE_TO_PDF_ENDPOINT: Endpoint = "archive_to_pdf"
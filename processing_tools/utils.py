@@ -1,17 +1,68 @@
 import os
+import shutil
+from pathlib import Path
+from typing import Optional
 
 import requests
 
 from processing_tools.settings import settings
+from processing_tools.workspace import SCRATCH_OUTPUT_FACTOR, ScratchReservation
 
 
-def download_local_file(url, file_path):
-    input_file_response = requests.get(url, allow_redirects=True)
-    with open(file_path, "wb") as f:
-        for chunk in input_file_response.iter_content(
-            chunk_size=settings.iter_chunk_size
-        ):
+def open_download(url) -> requests.Response:
+    """
+    Start downloading `url`. Only the headers have been read when this returns,
+    so the caller can look at the size before deciding where to store the body.
+    """
+    return requests.get(url, allow_redirects=True, stream=True)
+
+
+def get_content_length(response: requests.Response) -> Optional[int]:
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def save_download(
+    input_file_response: requests.Response,
+    file_path,
+    chunk_size: int = settings.iter_chunk_size,
+    scratch: Optional[ScratchReservation] = None,
+) -> Path:
+    """
+    Write the body of `input_file_response` to `file_path`.
+
+    With `scratch`, the reservation grows with the bytes actually written, which
+    differ from the Content-Length it was made for when that is missing, wrong
+    or of a compressed body. A download outgrowing memory-backed scratch space
+    is moved to disk. Returns the path the body was written to.
+    """
+    path = Path(file_path)
+    written = 0
+    f = open(path, "wb")
+    try:
+        for chunk in input_file_response.iter_content(chunk_size=chunk_size):
+            written += len(chunk)
+            if (
+                scratch
+                and SCRATCH_OUTPUT_FACTOR * written > scratch.size
+                and not scratch.grow(written)
+            ):
+                f.close()
+                scratch.spill()
+                spilled_path = scratch.dir / path.name
+                shutil.move(path, spilled_path)
+                path = spilled_path
+                f = open(path, "ab")
             f.write(chunk)
+    finally:
+        f.close()
+    return path
+
+
+def download_local_file(url, file_path):
+    save_download(open_download(url), file_path)
 
 
 def filename_to_pdf_name(filename: str) -> str:
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Literal, Optional, Sequence
+
+import psutil  # type: ignore
+import requests
+from starlette.concurrency import run_in_threadpool
+
+from processing_tools import office, spreadsheet
+from processing_tools.html import MARGIN, SCALE, run_wkhtmltopdf
+from processing_tools.libreoffice import LibreOfficePool
+from processing_tools.metrics import STARTUP_SECONDS, WARMUP_SECONDS
+from processing_tools.office import OfficeDocumentConverter
+from processing_tools.spreadsheet import XLSToXLSXConverter
+from processing_tools.types import FileConverter
+from processing_tools.workspace import (
+    ScratchSpace,
+    job_input_path,
+    job_output_path,
+    new_job_id,
+    release_job,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def process_uptime() -> float:
+    return time.time() - psutil.Process().create_time()
+
+
+EngineState = Literal["pending", "ok", "failed"]
+
+# sample files bundled in the image that each engine converts once
+OD_TO_PDF_SAMPLE = "test-word.docx"
+XLS_TO_XLSX_SAMPLE = "sample.xls"
+HTML_SAMPLE = "test.html"
+
+
+class WarmUp:
+    """
+    Converts a sample file with each engine once at startup, so the first
+    requests don't pay for cold starts like libreoffice creating its profile and
+    font caches.
+
+    Warm-up is done once every engine succeeded, failed or timed out; failures
+    are logged and reported in `engines` but don't hold back readiness.
+    """
+
+    def __init__(
+        self,
+        files_dir: str,
+        scratch_space: ScratchSpace,
+        browserless_endpoints: Sequence[str],
+        timeout: float,
+    ):
+        self.files_dir = Path(files_dir)
+        self.scratch_space = scratch_space
+        self.browserless_endpoints = browserless_endpoints
+        self.timeout = timeout
+        self.engines: Dict[str, EngineState] = {
+            "libreoffice": "pending",
+            "wkhtmltopdf": "pending",
+            "browserless": "pending",
+        }
+        self.done = False
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        t_start = time.perf_counter()
+        await asyncio.gather(
+            self._warm_up("libreoffice", self._libreoffice),
+            self._warm_up("wkhtmltopdf", self._wkhtmltopdf),
+            self._warm_up("browserless", self._browserless),
+        )
+        self.done = True
+        STARTUP_SECONDS.labels("ready").set(process_uptime())
+        logger.info(
+            "warm-up finished in %.2fs: %s", time.perf_counter() - t_start, self.engines
+        )
+
+    async def _warm_up(self, engine: str, fn: Callable[[], Awaitable[None]]) -> None:
+        t_start = time.perf_counter()
+        try:
+            await asyncio.wait_for(fn(), self.timeout)
+            self.engines[engine] = "ok"
+        except Exception:
+            logger.exception("warm-up of %s failed", engine)
+            self.engines[engine] = "failed"
+        WARMUP_SECONDS.labels(engine).set(time.perf_counter() - t_start)
+
+    async def _convert_sample(self, converter: FileConverter, name: str) -> None:
+        sample_path = self.files_dir / name
+        scratch = self.scratch_space.reserve(os.path.getsize(sample_path))
+        in_path = job_input_path(scratch.dir, new_job_id(), sample_path.suffix[1:])
+        out_path = converter.output_path(in_path)
+        try:
+            shutil.copyfile(sample_path, in_path)
+            await converter.convert(in_path)
+        finally:
+            release_job(scratch, in_path, out_path)
+
+    async def _warm_up_pool(
+        self, pool: LibreOfficePool, converter: FileConverter, name: str
+    ) -> None:
+        # at the same time, so every worker creates its profile
+        await asyncio.gather(
+            *(self._convert_sample(converter, name) for _ in range(pool.workers))
+        )
+
+    async def _libreoffice(self) -> None:
+        await self._warm_up_pool(
+            office.pool, OfficeDocumentConverter(None), OD_TO_PDF_SAMPLE
+        )
+        await self._warm_up_pool(
+            spreadsheet.pool, XLSToXLSXConverter(None), XLS_TO_XLSX_SAMPLE
+        )
+
+    async def _wkhtmltopdf(self) -> None:
+        sample_path = self.files_dir / HTML_SAMPLE
+        scratch = self.scratch_space.reserve(os.path.getsize(sample_path))
+        web_path = job_input_path(scratch.dir, new_job_id(), "html")
+        out_path = job_output_path(web_path, "pdf")
+        try:
+            shutil.copyfile(sample_path, web_path)
+            os.makedirs(out_path.parent, exist_ok=True)
+            await run_in_threadpool(run_wkhtmltopdf, web_path, out_path, None)
+        finally:
+            release_job(scratch, web_path, out_path)
+
+    async def _browserless(self) -> None:
+        html = (self.files_dir / HTML_SAMPLE).read_text(errors="replace")
+        params: dict = {
+            "html": html,
+            "options": {"printBackground": True, "scale": SCALE, "margin": MARGIN},
+        }
+
+        async def render(endpoint: str) -> None:
+            response = await run_in_threadpool(
+                requests.post, f"{endpoint}/pdf", json=params, timeout=self.timeout
+            )
+            response.raise_for_status()
+
+        # every endpoint, bypassing their circuit breakers
+        await asyncio.gather(*map(render, self.browserless_endpoints))
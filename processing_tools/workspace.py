@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Literal, Optional, Union
+
+from processing_tools.metrics import SCRATCH_BYTES, SCRATCH_RESERVATIONS, SCRATCH_SPILLS
+
+logger = logging.getLogger(__name__)
+
+
+ScratchMedium = Literal["memory", "disk"]
+
+# a job holds its input and its converted output in scratch space at once
+SCRATCH_OUTPUT_FACTOR = 2
+
+
+class ScratchReservation:
+    """
+    Scratch space reserved for a single job. Call `release` once the job's files
+    have been removed; it is safe to call more than once.
+    """
+
+    def __init__(
+        self, space: "ScratchSpace", dir: Path, medium: ScratchMedium, size: int
+    ):
+        self.space = space
+        self.dir = dir
+        self.medium = medium
+        self.size = size
+        self.released = False
+
+    def release(self) -> None:
+        self.space._release(self)
+
+    def grow(self, input_bytes: int) -> bool:
+        """
+        Grow the reservation for an input that turned out to be `input_bytes`,
+        e.g. because its download had no or a wrong Content-Length.
+
+        Returns False when the reservation is in memory and the input doesn't
+        fit there any more; `spill` it and move the job's files to its new `dir`.
+        """
+        return self.space._grow(self, input_bytes)
+
+    def spill(self) -> None:
+        """
+        Move the reservation from memory-backed scratch space to disk.
+        """
+        self.space._spill(self)
+
+    def __enter__(self) -> "ScratchReservation":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class ScratchSpace:
+    """
+    Hands out working directories to conversion jobs.
+
+    Jobs whose input is at most `memory_max_file_bytes` are placed in
+    `memory_dir` (e.g. a directory on the /dev/shm tmpfs) as long as the bytes
+    reserved there stay within `memory_budget_bytes`. Everything else, including
+    jobs whose size is unknown up front, is placed in `disk_dir`.
+    """
+
+    def __init__(
+        self,
+        disk_dir: Union[str, Path],
+        memory_dir: Optional[Union[str, Path]],
+        memory_max_file_bytes: int,
+        memory_budget_bytes: int,
+    ):
+        self.disk_dir = Path(disk_dir)
+        self.memory_dir = Path(memory_dir) if memory_dir else None
+        self.memory_max_file_bytes = memory_max_file_bytes
+        self.memory_budget_bytes = memory_budget_bytes
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.memory_dir and not self.memory_dir.parent.is_dir():
+            logger.warning(
+                "memory-backed scratch space %s is not available, using %s only",
+                self.memory_dir,
+                self.disk_dir,
+            )
+            self.memory_dir = None
+
+    @property
+    def roots(self) -> List[Path]:
+        if self.memory_dir:
+            return [self.disk_dir, self.memory_dir]
+        return [self.disk_dir]
+
+    def reserve(self, size_hint: Optional[int]) -> ScratchReservation:
+        """
+        Reserve scratch space for a job whose input is `size_hint` bytes.
+        """
+        medium: ScratchMedium = "disk"
+        size = SCRATCH_OUTPUT_FACTOR * (size_hint or 0)
+
+        with self._lock:
+            if (
+                self.memory_dir
+                and size_hint is not None
+                and size_hint <= self.memory_max_file_bytes
+            ):
+                if self.memory_bytes + size <= self.memory_budget_bytes:
+                    medium = "memory"
+                else:
+                    SCRATCH_SPILLS.inc()
+
+            if medium == "memory":
+                self.memory_bytes += size
+            else:
+                self.disk_bytes += size
+
+        dir = (
+            self.memory_dir if medium == "memory" and self.memory_dir else self.disk_dir
+        )
+        os.makedirs(dir, exist_ok=True)
+        SCRATCH_RESERVATIONS.labels(medium).inc()
+        SCRATCH_BYTES.labels(medium).inc(size)
+        return ScratchReservation(self, dir, medium, size)
+
+    def _grow(self, reservation: ScratchReservation, input_bytes: int) -> bool:
+        size = SCRATCH_OUTPUT_FACTOR * input_bytes
+        with self._lock:
+            if reservation.released or size <= reservation.size:
+                return True
+            added = size - reservation.size
+            if reservation.medium == "memory":
+                if (
+                    input_bytes > self.memory_max_file_bytes
+                    or self.memory_bytes + added > self.memory_budget_bytes
+                ):
+                    return False
+                self.memory_bytes += added
+            else:
+                self.disk_bytes += added
+            reservation.size = size
+        SCRATCH_BYTES.labels(reservation.medium).inc(added)
+        return True
+
+    def _spill(self, reservation: ScratchReservation) -> None:
+        with self._lock:
+            if reservation.released or reservation.medium != "memory":
+                return
+            self.memory_bytes -= reservation.size
+            self.disk_bytes += reservation.size
+            reservation.medium = "disk"
+            reservation.dir = self.disk_dir
+        os.makedirs(self.disk_dir, exist_ok=True)
+        SCRATCH_BYTES.labels("memory").dec(reservation.size)
+        SCRATCH_BYTES.labels("disk").inc(reservation.size)
+        SCRATCH_SPILLS.inc()
+
+    def _release(self, reservation: ScratchReservation) -> None:
+        with self._lock:
+            if reservation.released:
+                return
+            reservation.released = True
+            if reservation.medium == "memory":
+                self.memory_bytes -= reservation.size
+            else:
+                self.disk_bytes -= reservation.size
+        SCRATCH_BYTES.labels(reservation.medium).dec(reservation.size)
+
+
+class JobOutput:
+    """
+    The converted file of a job, in the job's scratch space.
+    """
+
+    def __init__(self, scratch: ScratchReservation, path: Path):
+        self.scratch = scratch
+        self.path = path
+
+    def release(self) -> None:
+        release_job(self.scratch, self.path)
+
+
+def new_job_id() -> str:
+    """
+    A unique stem for the files belonging to a single conversion job.
+
+    Jobs share a work directory, so every file a job writes is named after its id.
+    """
+    return uuid.uuid4().hex
+
+
+def job_input_path(work_dir: Union[str, Path], job_id: str, extension: str) -> Path:
+    """
+    >>> job_input_path("/tmp/work", "abc", "docx")
+    PosixPath('/tmp/work/abc.docx')
+    """
+    return Path(work_dir) / f"{job_id}.{extension}"
+
+
+def job_output_path(in_path: Path, extension: str) -> Path:
+    """
+    The path a converter writes its result for `in_path` to.
+
+    Outputs go in a sub-directory named after the output extension, so an input
+    that already has the output extension (e.g. an `.xlsx` sent to xls_to_xlsx)
+    is never overwritten.
+
+    >>> job_output_path(Path("/tmp/work/abc.xlsx"), "xlsx")
+    PosixPath('/tmp/work/xlsx/abc.xlsx')
+    """
+    return in_path.parent / extension / f"{in_path.stem}.{extension}"
+
+
+def remove_job_files(*paths: Optional[Path]) -> None:
+    """
+    Remove the files of a finished job, ignoring the ones that were never written.
+    """
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def release_job(scratch: Optional[ScratchReservation], *paths: Optional[Path]) -> None:
+    """
+    Remove the files of a finished job and give back its scratch space.
+    """
+    remove_job_files(*paths)
+    if scratch:
+        scratch.release()
+
+
+def remove_orphaned_files(work_dir: Union[str, Path], max_age: float) -> int:
+    """
+    Remove files under `work_dir` that were last modified more than `max_age`
+    seconds ago. These are left behind by jobs that crashed or were killed.
+
+    Returns the number of files removed.
+    """
+    removed = 0
+    cutoff = time.time() - max_age
+    for root, _, files in os.walk(work_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                # removed by its job while we were walking
+                pass
+    return removed
+
+
+async def sweep_orphaned_files(
+    work_dir: Union[str, Path], max_age: float, interval: float
+) -> None:
+    """
+    Periodically remove orphaned files from `work_dir`. Runs until cancelled.
+    """
+    while True:
+        try:
+            removed = await asyncio.get_running_loop().run_in_executor(
+                None, remove_orphaned_files, work_dir, max_age
+            )
+            if removed:
+                logger.info("removed %d orphaned files from %s", removed, work_dir)
+        except Exception:
+            logger.exception("sweeping orphaned files from %s failed", work_dir)
+        await asyncio.sleep(interval)
@@ -0,0 +1,225 @@
+import asyncio
+import functools
+import io
+import json
+import threading
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from processing_tools.archive import ArchiveLimitError, convert_members, list_members
+from processing_tools.libreoffice import LibreOfficePool
+from processing_tools.main import app
+from processing_tools.office import OfficeDocumentConverter
+from processing_tools.pdf import DamagedPDFError
+from processing_tools.pipeline import PrefetchPool
+from processing_tools.settings import settings
+from processing_tools.types import ARCHIVE_TO_PDF_ENDPOINT
+
+FILES = Path(__file__).parent / "files"
+PDF = (FILES / "test-word.pdf").read_bytes()
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def archive_server(tmp_path):
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(tmp_path))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def write_archive(path: Path, members: dict) -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+@pytest.mark.no_deps
+def test_list_members_limits(tmp_path):
+    path = tmp_path / "files.zip"
+    write_archive(
+        path,
+        {
+            "docs/": b"",
+            "docs/a.pdf": PDF,
+            "docs/b.pdf": PDF,
+            "__MACOSX/docs/._a.pdf": b"resource fork",
+            "docs/.DS_Store": b"",
+        },
+    )
+
+    members = list_members(path, 2, 2 * len(PDF))
+    assert [info.filename for info in members] == ["docs/a.pdf", "docs/b.pdf"]
+
+    with pytest.raises(ArchiveLimitError):
+        list_members(path, 1, 2 * len(PDF))
+    with pytest.raises(ArchiveLimitError):
+        # a zip bomb is rejected before anything is extracted
+        list_members(path, 2, 2 * len(PDF) - 1)
+
+
+@pytest.mark.no_deps
+def test_archive_to_zip_with_manifest(tmp_path, archive_server):
+    write_archive(
+        tmp_path / "files.zip",
+        {
+            "a.pdf": PDF,
+            # named like a document, but a PDF
+            "reports/b.docx": PDF,
+            "page.html": b"<!doctype html><html></html>",
+        },
+    )
+
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/files.zip", "output": "zip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert sorted(archive.namelist()) == [
+            "a.pdf",
+            "manifest.json",
+            "reports/b.pdf",
+        ]
+        assert archive.read("reports/b.pdf") == PDF
+        manifest = json.loads(archive.read("manifest.json"))
+
+    assert manifest["converted"] == 2
+    assert manifest["failed"] == 1
+    a, b, page = manifest["members"]
+    assert (a["name"], a["status"], a["output"]) == ("a.pdf", "ok", "a.pdf")
+    assert (b["format"], b["output"]) == ("pdf", "reports/b.pdf")
+    assert page["status"] == "error"
+    assert page["output"] is None
+    assert "unsupported input format" in page["error"]
+    # the scratch files of the job are gone once the response was sent
+    assert not list(Path(settings.work_dir).rglob("*.pdf"))
+
+
+@pytest.mark.no_deps
+def test_archive_to_pdf_with_manifest_header(tmp_path, archive_server):
+    write_archive(tmp_path / "files.zip", {"a.pdf": PDF, "notes.txt": b""})
+
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/files.zip"}
+    )
+    assert response.status_code == 200
+    assert response.content == PDF
+
+    manifest = json.loads(response.headers["x-archive-manifest"])
+    assert [member["status"] for member in manifest["members"]] == ["ok", "error"]
+
+
+@pytest.mark.no_deps
+def test_archive_manifest_header_is_truncated(tmp_path, archive_server):
+    members = {"a.pdf": PDF}
+    members.update({f"notes/{'long-name-' * 5}{n}.txt": b"" for n in range(50)})
+    write_archive(tmp_path / "files.zip", members)
+
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/files.zip"}
+    )
+    assert response.status_code == 200
+    assert len(response.headers["x-archive-manifest"]) <= 4096
+    assert json.loads(response.headers["x-archive-manifest"]) == {
+        "converted": 1,
+        "failed": 50,
+        "truncated": True,
+    }
+
+
+@pytest.mark.no_deps
+def test_archive_skips_damaged_pdfs(tmp_path, archive_server, monkeypatch):
+    write_archive(tmp_path / "files.zip", {"a.pdf": PDF, "b.pdf": b"%PDF-1.7\n"})
+
+    def check_pdf(path):
+        if path.read_bytes() != PDF:
+            raise DamagedPDFError()
+
+    monkeypatch.setattr("processing_tools.archive.check_pdf", check_pdf)
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/files.zip"}
+    )
+    assert response.status_code == 200
+    assert response.content == PDF
+
+    manifest = json.loads(response.headers["x-archive-manifest"])
+    a, b = manifest["members"]
+    assert a["status"] == "ok"
+    assert (b["status"], b["error"]) == ("error", "damaged PDF")
+
+
+@pytest.mark.no_deps
+def test_archive_rejections(tmp_path, archive_server, monkeypatch):
+    (tmp_path / "file.zip").write_bytes(PDF)
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/file.zip"}
+    )
+    assert response.status_code == 415
+
+    write_archive(tmp_path / "files.zip", {"page.html": b"<html></html>"})
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/files.zip"}
+    )
+    assert response.status_code == 422
+    assert response.json()["failed"] == 1
+
+    monkeypatch.setattr(settings, "archive_max_members", 0)
+    response = client.post(
+        "/archive_to_pdf/", json={"url": f"{archive_server}/files.zip"}
+    )
+    assert response.status_code == 413
+
+
+@pytest.mark.no_deps
+async def test_archive_members_queue_with_single_files(tmp_path):
+    archive_path = tmp_path / "files.zip"
+    write_archive(archive_path, {"a.pdf": PDF, "b.pdf": PDF})
+    members = list_members(archive_path, 2, 2 * len(PDF))
+    pool = PrefetchPool(max_jobs=1, max_bytes=10 * len(PDF))
+
+    async with pool.slot():
+        # a single file holds the only slot, the archive waits for it
+        converting = asyncio.ensure_future(
+            convert_members(
+                ARCHIVE_TO_PDF_ENDPOINT,
+                None,
+                archive_path,
+                members,
+                tmp_path,
+                OfficeDocumentConverter(None),
+                2,
+                pool,
+            )
+        )
+        await asyncio.sleep(0.1)
+        assert not converting.done()
+
+    converted = await asyncio.wait_for(converting, timeout=5)
+    assert [result["status"] for result, _ in converted] == ["ok", "ok"]
+    assert pool.jobs == 0 and pool.bytes == 0
+
+
+@pytest.mark.no_deps
+async def test_libreoffice_workers_have_their_own_profiles(tmp_path):
+    pool = LibreOfficePool("od_to_pdf", 3, str(tmp_path))
+
+    async with pool.worker() as first, pool.worker() as second:
+        async with pool.worker() as third:
+            assert first == [
+                f"-env:UserInstallation={(tmp_path / 'od_to_pdf-0').as_uri()}"
+            ]
+            assert second == [
+                f"-env:UserInstallation={(tmp_path / 'od_to_pdf-1').as_uri()}"
+            ]
+            assert third == [
+                f"-env:UserInstallation={(tmp_path / 'od_to_pdf-2').as_uri()}"
+            ]
@@ -0,0 +1,239 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from processing_tools import main
+from processing_tools.assets import (
+    AssetCache,
+    AssetProxy,
+    freshness_lifetime,
+    read_asset,
+    serve_asset,
+)
+
+proxy = AssetProxy("http://ptools:8080/", "secret")
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.path.startswith("/large"):
+            self.send_response(200)
+            self.send_header("Cache-Control", "max-age=600")
+            if self.path.endswith("announced.png"):
+                self.send_header("Content-Length", str(1024 * 1024 * 1024))
+            self.end_headers()
+            try:
+                # without a length, until the client hangs up
+                while True:
+                    self.wfile.write(b"x" * 64 * 1024)
+            except OSError:
+                return
+        body = b"x" * 100
+        self.send_response(200)
+        if self.path.endswith(".css"):
+            body = b'body { background: url("img/bg.png"); }'
+            self.send_header("Content-Type", "text/css")
+        if self.path.startswith("/no-store"):
+            self.send_header("Cache-Control", "no-store")
+        else:
+            self.send_header("Cache-Control", "max-age=600")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AssetHandler)
+    AssetHandler.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.mark.no_deps
+def test_proxy_urls_are_signed():
+    url = proxy.url_for("https://example.com/a.css?v=1")
+    assert url.startswith("http://ptools:8080/asset-cache/")
+
+    token = url.rsplit("/", 1)[1]
+    assert proxy.origin_url(token) == "https://example.com/a.css?v=1"
+
+    other = proxy.url_for("https://example.com/b.css").rsplit("/", 1)[1]
+    forged = token.split(".")[0] + "." + other.split(".")[1]
+    assert proxy.origin_url(forged) is None
+    assert proxy.origin_url("garbage") is None
+
+
+@pytest.mark.no_deps
+def test_rewrite_html():
+    page = (
+        "<html><head><link rel=stylesheet href='/css/site.css'>"
+        '<style>@import "print.css"; h1 { background: url(h1.png) }</style>'
+        "</head><body><a href='/about'>about</a>"
+        '<img src="img/a.png" srcset="img/a.png 1x, img/a@2x.png 2x">'
+        '<img src="data:image/png;base64,AAAA">'
+        "</body></html>"
+    )
+    rewritten = proxy.rewrite_html(page, "https://example.com/docs/page.html")
+
+    assert '<base href="https://example.com/docs/page.html">' in rewritten
+    assert "<a href='/about'>" in rewritten
+    assert 'src="data:image/png;base64,AAAA"' in rewritten
+    for url in (
+        "https://example.com/css/site.css",
+        "https://example.com/docs/print.css",
+        "https://example.com/docs/h1.png",
+        "https://example.com/docs/img/a.png",
+        "https://example.com/docs/img/a@2x.png",
+    ):
+        assert proxy.url_for(url) in rewritten
+
+
+@pytest.mark.no_deps
+def test_rewrite_html_only_rewrites_css():
+    page = (
+        "<body><p>Use url(notes.txt) in your stylesheet</p>"
+        "<script>const css = 'url(app.png)';</script>"
+        '<div style="background: url(&quot;bg.png&quot;)">'
+        "<span style='background: url(dot.png)'>x</span></div></body>"
+    )
+    rewritten = proxy.rewrite_html(page, "https://example.com/page.html")
+
+    assert "<p>Use url(notes.txt) in your stylesheet</p>" in rewritten
+    assert "<script>const css = 'url(app.png)';</script>" in rewritten
+    for url in ("https://example.com/bg.png", "https://example.com/dot.png"):
+        assert f"url(&quot;{proxy.url_for(url)}&quot;)" in rewritten
+
+
+@pytest.mark.no_deps
+def test_rewrite_html_keeps_base():
+    page = '<head><base href="https://cdn.example.com/"></head><img src="a.png">'
+    rewritten = proxy.rewrite_html(page, "https://example.com/page.html")
+    assert rewritten.count("<base") == 1
+    assert proxy.url_for("https://cdn.example.com/a.png") in rewritten
+
+
+@pytest.mark.no_deps
+def test_freshness_lifetime():
+    assert freshness_lifetime({"Cache-Control": "private, max-age=30"}, 60) == 30
+    assert freshness_lifetime({"Cache-Control": "no-store, max-age=30"}, 60) is None
+    assert (
+        freshness_lifetime(
+            {
+                "Date": "Mon, 19 Oct 2026 10:00:00 GMT",
+                "Expires": "Mon, 19 Oct 2026 10:05:00 GMT",
+            },
+            60,
+        )
+        == 300
+    )
+    assert freshness_lifetime({"Expires": "0"}, 60) == 0
+
+
+@pytest.mark.no_deps
+def test_asset_cache_hits_and_evicts(tmp_path, origin):
+    cache = AssetCache(tmp_path, 250, 1000, 60, 5)
+
+    status_code, asset = cache.fetch(f"{origin}/a.png")
+    assert status_code == 200 and asset and cache.is_cached(asset)
+    assert asset.path.read_bytes() == b"x" * 100
+    cache.fetch(f"{origin}/a.png")
+    assert AssetHandler.requests == 1
+
+    cache.fetch(f"{origin}/b.png")
+    cache.fetch(f"{origin}/a.png")
+    cache.fetch(f"{origin}/c.png")
+    # b.png was the least recently used
+    assert cache.bytes == 200
+    assert len(list(tmp_path.glob("*.body"))) == 2
+    cache.fetch(f"{origin}/a.png")
+    assert AssetHandler.requests == 3
+
+    # the index survives a restart
+    assert AssetCache(tmp_path, 250, 1000, 60, 5).bytes == 200
+
+
+@pytest.mark.no_deps
+def test_asset_cache_uncacheable(tmp_path, origin):
+    cache = AssetCache(tmp_path, 1000, 1000, 60, 5)
+
+    status_code, asset = cache.fetch(f"{origin}/no-store.png")
+    assert status_code == 200 and asset and not cache.is_cached(asset)
+    assert cache.bytes == 0
+
+    status_code, asset = cache.fetch(f"{origin}/missing.png")
+    assert status_code == 404 and asset is None
+
+
+@pytest.mark.no_deps
+def test_serve_asset_rewrites_css(tmp_path, origin):
+    cache = AssetCache(tmp_path, 1000, 1000, 60, 5)
+    token = proxy.url_for(f"{origin}/css/site.css").rsplit("/", 1)[1]
+
+    status_code, asset, css = serve_asset(cache, proxy, token)
+    assert status_code == 200 and asset and css
+    assert proxy.url_for(f"{origin}/css/img/bg.png") in css
+
+    assert serve_asset(cache, proxy, "forged.token") == (404, None, None)
+
+
+@pytest.mark.no_deps
+def test_read_asset_removes_uncached_files(tmp_path, origin):
+    cache = AssetCache(tmp_path, 1000, 1000, 60, 5)
+    token = proxy.url_for(f"{origin}/no-store.png").rsplit("/", 1)[1]
+
+    status_code, asset, body = read_asset(cache, proxy, token)
+    assert status_code == 200 and asset and body and not isinstance(body, str)
+    assert not asset.path.exists()
+    # the file was opened before it was removed
+    with body:
+        assert body.read() == b"x" * 100
+
+
+@pytest.mark.no_deps
+@pytest.mark.parametrize("path", ["/large/announced.png", "/large/endless.png"])
+def test_asset_cache_rejects_large_assets(tmp_path, origin, path):
+    cache = AssetCache(tmp_path, 10 * 1024 * 1024, 1024 * 1024, 60, 5)
+
+    # the download stops at the limit instead of running forever
+    assert cache.fetch(f"{origin}{path}") == (502, None)
+    assert cache.bytes == 0
+    assert not [path for path in tmp_path.iterdir() if path.is_file()]
+
+
+@pytest.mark.no_deps
+def test_asset_cache_endpoint_streams_files(tmp_path, origin, monkeypatch):
+    cache = AssetCache(tmp_path, 1000, 1000, 60, 5)
+    monkeypatch.setattr(main, "asset_cache", cache)
+    with ThreadPoolExecutor(1) as executor:
+        monkeypatch.setattr(main, "asset_cache_executor", executor)
+        client = TestClient(main.app)
+        signed = AssetProxy("http://testserver", main.settings.asset_cache_secret)
+
+        for path in ["/no-store.png", "/a.png"]:
+            response = client.get(signed.url_for(f"{origin}{path}"))
+            assert response.status_code == 200
+            assert response.content == b"x" * 100
+            assert response.headers["content-length"] == "100"
+
+        response = client.get(signed.url_for(f"{origin}/large/endless.png"))
+        assert response.status_code == 502
+
+    # only the cached asset is left
+    assert [path.suffix for path in tmp_path.glob("*.body")] == [".body"]
+    assert not list(tmp_path.glob("*.tmp"))
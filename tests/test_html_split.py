@@ -0,0 +1,98 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from processing_tools.html import run_wkhtmltopdf_split
+from processing_tools.html_split import split_html
+
+HEAD = '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"></head>\n<body class="report">'
+TAIL = "</body>\n</html>\n"
+
+
+@pytest.mark.no_deps
+def test_split_keeps_head_and_body_attributes():
+    sections = [f"<section>{idx}{'x' * 100}</section>\n" for idx in range(4)]
+    text = HEAD + "".join(sections) + TAIL
+
+    split = split_html(text, 4)
+
+    assert len(split) == 4
+    for section, html in zip(sections, split):
+        assert html.startswith(HEAD)
+        assert html.endswith(TAIL)
+        assert section in html
+
+
+@pytest.mark.no_deps
+def test_split_only_between_top_level_elements():
+    nested = "<div>" + "<p>paragraph</p>" * 20 + "</div>"
+    text = HEAD + nested + "<div>after</div>" + TAIL
+
+    split = split_html(text, 8)
+
+    assert split == [HEAD + nested + TAIL, HEAD + "<div>after</div>" + TAIL]
+
+
+@pytest.mark.no_deps
+def test_split_recovers_from_unclosed_elements():
+    unclosed = "<div><p>one<p>" + "two" * 20 + "</div>"
+    text = HEAD + unclosed + "<hr>" + "<div>three</div>" + TAIL
+
+    split = split_html(text, 3)
+
+    assert split == [
+        HEAD + unclosed + TAIL,
+        HEAD + "<hr>" + TAIL,
+        HEAD + "<div>three</div>" + TAIL,
+    ]
+
+
+@pytest.mark.no_deps
+def test_unsplittable_documents_are_returned_whole():
+    assert split_html("just text", 4) == ["just text"]
+    assert split_html(HEAD + "<div>only</div>" + TAIL, 4) == [
+        HEAD + "<div>only</div>" + TAIL
+    ]
+    assert split_html(HEAD + "<div>a</div><div>b</div>" + TAIL, 1) == [
+        HEAD + "<div>a</div><div>b</div>" + TAIL
+    ]
+
+
+@pytest.mark.no_deps
+def test_split_renders_share_section_slots(tmp_path, monkeypatch):
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def fake_wkhtmltopdf(web_path: Path, out_path: Path, meta) -> None:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    monkeypatch.setattr("processing_tools.html.run_wkhtmltopdf", fake_wkhtmltopdf)
+    monkeypatch.setattr(
+        "processing_tools.html.merge_pdfs", lambda in_paths, out_path: None
+    )
+
+    text = HEAD + "".join(f"<p>{idx}{'x' * 100}</p>" for idx in range(4)) + TAIL
+    slots = threading.BoundedSemaphore(3)
+
+    def render_page(idx: int) -> None:
+        web_path = tmp_path / f"page-{idx}.html"
+        web_path.write_text(text)
+        run_wkhtmltopdf_split(web_path, tmp_path / f"page-{idx}.pdf", None, 4, slots)
+
+    requests = [threading.Thread(target=render_page, args=(i,)) for i in range(3)]
+    for request in requests:
+        request.start()
+    for request in requests:
+        request.join()
+
+    # three requests of four sections each, but never more than three processes
+    assert max_running == 3
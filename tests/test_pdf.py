@@ -0,0 +1,113 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from processing_tools.main import app
+from processing_tools.pdf import (
+    DamagedPDFError,
+    check_pdf,
+    ghostscript_optimize_args,
+    merge_pdfs,
+    optimize_pdf,
+)
+from processing_tools.types import OD_TO_PDF_ENDPOINT, PDFOptimizeOptions
+
+FILES = Path(__file__).parent / "files"
+
+client = TestClient(app)
+
+needs_qpdf = pytest.mark.skipif(shutil.which("qpdf") is None, reason="needs qpdf")
+
+
+def page_count(path: Path) -> int:
+    result = subprocess.run(
+        ["qpdf", "--show-npages", str(path)], stdout=subprocess.PIPE, check=True
+    )
+    return int(result.stdout)
+
+
+@pytest.mark.no_deps
+def test_ghostscript_optimize_args():
+    args = ghostscript_optimize_args(
+        Path("in.pdf"), Path("out.pdf"), PDFOptimizeOptions()
+    )
+    assert args[0] == "gs"
+    assert args[-2:] == ["-sOutputFile=out.pdf", "in.pdf"]
+    assert not [arg for arg in args if "Downsample" in arg]
+
+    args = ghostscript_optimize_args(
+        Path("in.pdf"), Path("out.pdf"), PDFOptimizeOptions(image_dpi=150)
+    )
+    assert "-dColorImageResolution=150" in args
+    assert "-dGrayImageResolution=150" in args
+    assert "-dMonoImageResolution=150" in args
+
+
+@pytest.mark.no_deps
+def test_optimize_invalid_requests():
+    response = client.post(
+        "/od_to_pdf/",
+        json={"url": "https://example.com/a.docx", "optimize": {"image_dpi": 0}},
+    )
+    assert response.status_code == 422
+
+    response = client.post(
+        "/html_to_pdf/",
+        json={
+            "url": "https://example.com",
+            "engine": "wkhtmltopdf",
+            "optimize": {"image_dpi": "high"},
+        },
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.no_deps
+def test_optimize_falls_back_without_ghostscript(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    pdf = tmp_path / "converted.pdf"
+    shutil.copyfile(FILES / "test-word.pdf", pdf)
+
+    out_path = optimize_pdf(pdf, PDFOptimizeOptions(), OD_TO_PDF_ENDPOINT, None)
+
+    assert out_path == pdf
+    assert pdf.exists()
+    assert [path.name for path in tmp_path.iterdir()] == ["converted.pdf"]
+
+
+@needs_qpdf
+def test_merge_pdfs(tmp_path):
+    pdf = FILES / "test-word.pdf"
+    out_path = tmp_path / "merged.pdf"
+
+    merge_pdfs([pdf, pdf], out_path)
+
+    assert page_count(out_path) == 2 * page_count(pdf)
+
+
+@needs_qpdf
+def test_merge_pdfs_recovers_damaged_inputs(tmp_path):
+    pdf = FILES / "test-word.pdf"
+    # a wrong xref offset, which qpdf repairs with a warning and exit code 3
+    data = pdf.read_bytes()
+    startxref = data.rindex(b"startxref")
+    damaged = tmp_path / "damaged.pdf"
+    damaged.write_bytes(data[:startxref] + b"startxref\n1\n%%EOF\n")
+    out_path = tmp_path / "merged.pdf"
+
+    merge_pdfs([pdf, damaged], out_path)
+
+    assert page_count(out_path) == 2 * page_count(pdf)
+
+
+@needs_qpdf
+def test_check_pdf(tmp_path):
+    check_pdf(FILES / "test-word.pdf")
+
+    damaged = tmp_path / "damaged.pdf"
+    damaged.write_bytes(b"%PDF-1.7\n")
+    with pytest.raises(DamagedPDFError):
+        check_pdf(damaged)
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import zipfile
+from contextlib import AsyncExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from processing_tools import main
+from processing_tools.pipeline import PrefetchPool
+from processing_tools.spreadsheet import XLSToXLSXConverter
+from processing_tools.types import OD_TO_PDF_ENDPOINT, XLS_TO_XLSX_ENDPOINT
+
+CONTENT_TYPES = (
+    b'<Types><Override PartName="/xl/workbook.xml" ContentType="application/'
+    b'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/></Types>'
+)
+
+
+class XLSXHandler(BaseHTTPRequestHandler):
+    """
+    Serves a workbook, which /xls_to_xlsx/ passes through without libreoffice.
+    """
+
+    body = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        if not self.path.startswith("/unknown-size"):
+            self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        # without a Content-Length, the body ends when the connection closes
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def xlsx_server(tmp_path):
+    path = tmp_path / "book.xlsx"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("xl/workbook.xml", b"<workbook/>")
+    XLSXHandler.body = path.read_bytes()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), XLSXHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def convert_xlsx(url: str):
+    return main.convert_file(
+        XLS_TO_XLSX_ENDPOINT,
+        main.ConversionURLOnlyRequest(url=url),
+        XLSToXLSXConverter(None),
+    )
+
+
+@pytest.mark.no_deps
+async def test_prefetch_pool_bounds_jobs():
+    pool = PrefetchPool(max_jobs=2, max_bytes=1000)
+    running = []
+    max_running = 0
+
+    async def job():
+        nonlocal max_running
+        async with pool.slot():
+            running.append(1)
+            max_running = max(max_running, len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    await asyncio.gather(*[job() for _ in range(5)])
+
+    assert max_running == 2
+    assert pool.jobs == 0
+
+
+@pytest.mark.no_deps
+async def test_prefetch_pool_bounds_bytes():
+    pool = PrefetchPool(max_jobs=10, max_bytes=100)
+    order = []
+
+    async def job(name, size):
+        async with pool.slot() as slot:
+            await slot.reserve(size)
+            order.append(name)
+            await asyncio.sleep(0.01)
+        order.append(f"{name} done")
+
+    await asyncio.gather(job("a", 80), job("b", 80), job("c", 10))
+
+    # b has to wait for a's bytes, c fits next to a
+    assert order.index("b") > order.index("a done")
+    assert order.index("c") < order.index("a done")
+    assert pool.bytes == 0
+
+
+@pytest.mark.no_deps
+async def test_prefetch_pool_admits_oversized_job_when_empty():
+    pool = PrefetchPool(max_jobs=2, max_bytes=100)
+
+    async with pool.slot() as slot:
+        await asyncio.wait_for(slot.reserve(500), timeout=1)
+        slot.grow(20)
+        assert pool.bytes == 520
+
+    assert pool.bytes == 0
+
+
+@pytest.mark.no_deps
+async def test_endpoints_have_their_own_prefetch_pools(xlsx_server, monkeypatch):
+    od_to_pdf_pool = PrefetchPool(max_jobs=2, max_bytes=1000)
+    monkeypatch.setitem(main.prefetch_pools, OD_TO_PDF_ENDPOINT, od_to_pdf_pool)
+    monkeypatch.setitem(
+        main.prefetch_pools, XLS_TO_XLSX_ENDPOINT, PrefetchPool(2, 1000)
+    )
+
+    async with AsyncExitStack() as backlog:
+        # od_to_pdf jobs hold all of its slots
+        for _ in range(od_to_pdf_pool.max_jobs):
+            await backlog.enter_async_context(od_to_pdf_pool.slot())
+
+        output = await asyncio.wait_for(
+            convert_xlsx(f"{xlsx_server}/book.xlsx"), timeout=5
+        )
+        assert output.path.read_bytes() == XLSXHandler.body
+        output.release()
+
+
+@pytest.mark.no_deps
+async def test_prefetch_reserves_downloads_of_unknown_size(xlsx_server, monkeypatch):
+    pool = PrefetchPool(max_jobs=2, max_bytes=1000)
+    monkeypatch.setitem(main.prefetch_pools, XLS_TO_XLSX_ENDPOINT, pool)
+    monkeypatch.setattr(main.settings, "prefetch_unknown_size_bytes", 600)
+
+    async with pool.slot() as slot:
+        await slot.reserve(500)
+        # 600 bytes don't fit next to 500, however small the download is
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                convert_xlsx(f"{xlsx_server}/unknown-size.xlsx"), timeout=0.5
+            )
+
+    output = await asyncio.wait_for(
+        convert_xlsx(f"{xlsx_server}/unknown-size.xlsx"), timeout=5
+    )
+    assert output.path.read_bytes() == XLSXHandler.body
+    output.release()
+    assert pool.bytes == 0
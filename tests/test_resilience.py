@@ -0,0 +1,194 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from processing_tools import main
+from processing_tools.html import (
+    BrowserlessClient,
+    BrowserlessError,
+    BrowserlessUnavailableError,
+)
+from processing_tools.resilience import AttemptsFailedError, CircuitBreaker, hedged_call
+
+# nothing listens on the discard port
+DEAD_ENDPOINT = "http://127.0.0.1:9"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def breaker(name="backend", clock=time.monotonic):
+    return CircuitBreaker(
+        name,
+        window=4,
+        min_calls=4,
+        error_ratio=0.5,
+        slow_call_seconds=10,
+        slow_call_ratio=0.75,
+        open_seconds=30,
+        clock=clock,
+    )
+
+
+@pytest.mark.no_deps
+def test_circuit_breaker_opens_on_errors():
+    clock = Clock()
+    circuit = breaker(clock=clock)
+    for ok in (True, False, True):
+        assert circuit.allow()
+        circuit.record(ok, 1)
+    assert circuit.state == "closed"
+    circuit.record(False, 1)
+    assert circuit.state == "open"
+    assert not circuit.allow()
+
+    clock.now = 30
+    assert circuit.allow()
+    assert circuit.state == "half_open"
+    # only a single trial call
+    assert not circuit.allow()
+    circuit.record(False, 1)
+    assert circuit.state == "open"
+
+    clock.now = 60
+    assert circuit.allow()
+    circuit.record(True, 1)
+    assert circuit.state == "closed"
+
+
+@pytest.mark.no_deps
+def test_circuit_breaker_opens_on_slow_calls():
+    circuit = breaker()
+    for seconds in (1, 10, 11, 12):
+        circuit.record(True, seconds)
+    assert circuit.state == "open"
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def succeed_after(seconds, result):
+    def attempt():
+        time.sleep(seconds)
+        return result
+
+    return attempt
+
+
+@pytest.mark.no_deps
+def test_hedged_call_fails_over():
+    assert hedged_call([fail, fail, lambda: "third"], 0) == "third"
+
+    with pytest.raises(AttemptsFailedError) as e:
+        hedged_call([fail, fail], 0)
+    assert len(e.value.errors) == 2
+
+
+@pytest.mark.no_deps
+def test_hedged_call_hedges_slow_attempts():
+    discarded = []
+    t_start = time.perf_counter()
+    result = hedged_call(
+        [succeed_after(0.5, "slow"), succeed_after(0, "fast")],
+        0.05,
+        discard=discarded.append,
+    )
+    assert result == "fast"
+    assert time.perf_counter() - t_start < 0.4
+
+    time.sleep(0.6)
+    assert discarded == ["slow"]
+
+    # without hedging the second attempt only runs when the first failed
+    assert hedged_call([succeed_after(0.1, "slow"), succeed_after(0, "fast")], 0) == (
+        "slow"
+    )
+
+
+class BrowserlessHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        status_code = 400 if self.path.startswith("/bad") else 200
+        body = b"%PDF-1.4\n" if status_code == 200 else b"bad request"
+        self.send_response(status_code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def browserless():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BrowserlessHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.mark.no_deps
+def test_browserless_client(browserless):
+    client = BrowserlessClient([DEAD_ENDPOINT, browserless], breaker, (1, 5))
+    response = client.post("/pdf", {"url": "https://example.com"})
+    assert response.content == b"%PDF-1.4\n"
+    assert client.breakers[DEAD_ENDPOINT].outcomes[-1] == (True, False)
+
+    with pytest.raises(BrowserlessError) as e:
+        client.post("/bad", {})
+    assert e.value.status_code == 400
+
+    client = BrowserlessClient([DEAD_ENDPOINT], breaker, (1, 5))
+    for _ in range(4):
+        with pytest.raises(BrowserlessUnavailableError):
+            client.post("/pdf", {})
+    assert client.breakers[DEAD_ENDPOINT].state == "open"
+
+
+@pytest.mark.no_deps
+def test_browserless_client_records_unexpected_errors(monkeypatch):
+    clock = Clock()
+    client = BrowserlessClient(
+        [DEAD_ENDPOINT], lambda name: breaker(name, clock), (1, 5)
+    )
+    circuit = client.breakers[DEAD_ENDPOINT]
+    for _ in range(4):
+        circuit.record(False, 1)
+    clock.now = 30
+
+    def broken_post(*args, **kwargs):
+        raise ValueError("not a requests error")
+
+    monkeypatch.setattr("processing_tools.html.requests.post", broken_post)
+    # the half-open trial call fails outside of requests
+    with pytest.raises(BrowserlessUnavailableError):
+        client.post("/pdf", {})
+    assert circuit.state == "open"
+
+    # and the circuit still gets its next trial
+    clock.now = 60
+    assert circuit.allow()
+
+
+@pytest.mark.no_deps
+def test_browserless_falls_back(monkeypatch):
+    monkeypatch.setattr(
+        main, "browserless_client", BrowserlessClient([DEAD_ENDPOINT], breaker, (1, 5))
+    )
+    request = main.ConversionRequest(url="https://example.com", engine="browserless")
+    assert main.html_to_pdf_browserless_or_fallback(request, lambda: "fallback") == (
+        "fallback"
+    )
+
+    monkeypatch.setattr(main.settings, "browserless_fallback_enabled", False)
+    with pytest.raises(BrowserlessUnavailableError):
+        main.html_to_pdf_browserless_or_fallback(request, lambda: "fallback")
@@ -0,0 +1,78 @@
+import pytest
+from starlette.background import BackgroundTask
+
+from processing_tools.responses import (
+    PATHSEND_EXTENSION,
+    ZEROCOPY_EXTENSION,
+    ZeroCopyFileResponse,
+)
+
+
+async def receive():
+    return {"type": "http.request"}
+
+
+def http_scope(extensions=None):
+    return {"type": "http", "method": "GET", "extensions": extensions or {}}
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "out.pdf"
+    path.write_bytes(b"%PDF-1.5\n" + b"x" * (3 * ZeroCopyFileResponse.chunk_size))
+    return path
+
+
+@pytest.mark.no_deps
+async def test_streams_file_without_extensions(pdf_path):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await ZeroCopyFileResponse(pdf_path)(http_scope(), receive, send)
+
+    assert messages[0]["type"] == "http.response.start"
+    assert (b"content-length", str(pdf_path.stat().st_size).encode()) in messages[0][
+        "headers"
+    ]
+    body = b"".join(m["body"] for m in messages[1:])
+    assert body == pdf_path.read_bytes()
+    assert not messages[-1]["more_body"]
+
+
+@pytest.mark.no_deps
+async def test_hands_file_to_server(pdf_path):
+    messages = []
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            message = dict(message, file=message["file"].read())
+        messages.append(message)
+
+    await ZeroCopyFileResponse(pdf_path)(
+        http_scope({PATHSEND_EXTENSION: {}}), receive, send
+    )
+    assert messages[1] == {"type": PATHSEND_EXTENSION, "path": str(pdf_path)}
+
+    messages.clear()
+    await ZeroCopyFileResponse(pdf_path)(
+        http_scope({ZEROCOPY_EXTENSION: {}}), receive, send
+    )
+    assert messages[1]["file"] == pdf_path.read_bytes()
+    assert messages[1]["count"] == pdf_path.stat().st_size
+
+
+@pytest.mark.no_deps
+async def test_background_runs_when_client_disconnects(pdf_path):
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("client disconnected")
+
+    def cleanup():
+        pdf_path.unlink()
+
+    response = ZeroCopyFileResponse(pdf_path, background=BackgroundTask(cleanup))
+    with pytest.raises(OSError):
+        await response(http_scope(), receive, send)
+    assert not pdf_path.exists()
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from processing_tools.singleflight import SingleFlight
+
+
+@pytest.mark.no_deps
+async def test_concurrent_calls_are_coalesced():
+    single_flight: SingleFlight[str] = SingleFlight("od_to_pdf")
+    calls = []
+    cleaned_up = []
+
+    async def convert():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    flights = await asyncio.gather(
+        *[single_flight.do("key", convert, cleaned_up.append) for _ in range(3)]
+    )
+
+    assert len(calls) == 1
+    assert [flight.result for flight in flights] == ["result"] * 3
+    assert flights[0] is flights[1] is flights[2]
+
+    for flight in flights:
+        assert not cleaned_up
+        flight.release()
+    assert cleaned_up == ["result"]
+
+    # the next call, once the first one finished, runs again
+    await single_flight.do("key", convert)
+    assert len(calls) == 2
+
+
+@pytest.mark.no_deps
+async def test_errors_are_shared():
+    single_flight: SingleFlight[str] = SingleFlight("html_to_pdf")
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("could not convert")
+
+    results = await asyncio.gather(
+        single_flight.do("key", fail),
+        single_flight.do("key", fail),
+        return_exceptions=True,
+    )
+
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert not single_flight.flights
+
+
+@pytest.mark.no_deps
+async def test_cleanup_when_all_callers_went_away():
+    single_flight: SingleFlight[str] = SingleFlight("xls_to_xlsx")
+    cleaned_up = []
+    done = asyncio.Event()
+
+    async def convert():
+        await done.wait()
+        return "result"
+
+    caller = asyncio.ensure_future(single_flight.do("key", convert, cleaned_up.append))
+    await asyncio.sleep(0)
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+
+    done.set()
+    await asyncio.sleep(0.01)
+    assert cleaned_up == ["result"]
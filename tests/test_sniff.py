@@ -0,0 +1,228 @@
+import functools
+import struct
+import threading
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from processing_tools.main import app
+from processing_tools.office import OfficeDocumentConverter
+from processing_tools.sniff import (
+    EXTENSION_FORMATS,
+    MAGIC_FORMATS,
+    ODF_MIMETYPE_FORMATS,
+    OLE2_STREAM_FORMATS,
+    OOXML_CONTENT_TYPE_FORMATS,
+    TEXT_FORMATS,
+    sniff_format,
+)
+from processing_tools.spreadsheet import XLSToXLSXConverter
+
+FILES = Path(__file__).parent / "files"
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def files_server():
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(FILES))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.mark.no_deps
+@pytest.mark.parametrize(
+    "name, file_format",
+    [
+        ("sample.xls", "xls"),
+        ("test-word.docx", "docx"),
+        ("sample-powerpoint.pptx", "pptx"),
+        ("test-word.pdf", "pdf"),
+        ("test.html", "html"),
+        ("test.xhtml", "html"),
+    ],
+)
+def test_sniff_sample_files(name, file_format):
+    assert sniff_format(FILES / name) == file_format
+
+
+@pytest.mark.no_deps
+def test_sniff_ignores_extension(tmp_path):
+    path = tmp_path / "report.xls"
+    path.write_bytes((FILES / "test-word.docx").read_bytes())
+    assert sniff_format(path, "xls") == "docx"
+
+    path = tmp_path / "table.csv"
+    path.write_text("a,b\n1,2\n")
+    assert sniff_format(path, "csv") == "csv"
+    assert sniff_format(path, "") is None
+
+
+@pytest.mark.no_deps
+def test_sniff_odf(tmp_path):
+    path = tmp_path / "file"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/vnd.oasis.opendocument.spreadsheet")
+        archive.writestr("content.xml", "<office:document-content/>")
+    assert sniff_format(path) == "ods"
+
+
+def write_ooxml(path, content_type: str, directory: str) -> None:
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(
+            "[Content_Types].xml",
+            '<Types><Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/{directory}/main.xml" ContentType="{content_type}"/>'
+            "</Types>",
+        )
+        archive.writestr(f"{directory}/main.xml", "<main/>")
+
+
+@pytest.mark.no_deps
+@pytest.mark.parametrize(
+    "content_type, directory, file_format",
+    [
+        ("application/vnd.ms-excel.sheet.macroEnabled.main+xml", "xl", "xlsm"),
+        ("application/vnd.ms-excel.sheet.binary.macroEnabled.main", "xl", "xlsb"),
+        ("application/vnd.ms-word.document.macroEnabled.main+xml", "word", "docm"),
+        (
+            "application/vnd.ms-powerpoint.presentation.macroEnabled.main+xml",
+            "ppt",
+            "pptm",
+        ),
+        ("application/vnd.ms-visio.drawing.main+xml", "visio", "vsdx"),
+        ("application/xml", "xl", None),
+    ],
+)
+def test_sniff_ooxml_variants(tmp_path, content_type, directory, file_format):
+    path = tmp_path / "file"
+    write_ooxml(path, content_type, directory)
+    # never passed through as the plain format of their directory
+    assert sniff_format(path) == file_format
+
+
+@pytest.mark.no_deps
+def test_sniff_odf_templates(tmp_path):
+    path = tmp_path / "file"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/vnd.oasis.opendocument.text-template")
+    assert sniff_format(path) == "odt"
+
+
+@pytest.mark.no_deps
+@pytest.mark.parametrize(
+    "head, file_format",
+    [
+        (b"BM" + struct.pack("<IHHII", 70, 0, 0, 54, 40) + b"\x00" * 52, "bmp"),
+        (b"RIFF\x24\x00\x00\x00WEBPVP8 ", "webp"),
+        (b"\xffWPC\x10\x00\x00\x00", "wpd"),
+        # text starting like a bitmap
+        (b"BMW,Munich\nAudi,Ingolstadt\n", None),
+    ],
+)
+def test_sniff_image_and_document_signatures(tmp_path, head, file_format):
+    path = tmp_path / "file"
+    path.write_bytes(head)
+    assert sniff_format(path) == file_format
+
+
+@pytest.mark.no_deps
+def test_sniff_falls_back_to_libreoffice_extensions(tmp_path):
+    path = tmp_path / "file"
+    path.write_text('<?xml version="1.0"?><svg xmlns="http://www.w3.org/2000/svg"/>')
+    assert sniff_format(path, "svg") == "svg"
+    assert sniff_format(path, "") is None
+    # a signature that matches wins over the extension
+    path.write_bytes((FILES / "test-word.pdf").read_bytes())
+    assert sniff_format(path, "fodt") == "pdf"
+
+    path.write_bytes(b"")
+    assert sniff_format(path, "fodt") is None
+    path.write_bytes((FILES / "sample.xls").read_bytes()[:1024])
+    assert sniff_format(path, "xls") is None
+
+
+@pytest.mark.no_deps
+def test_accepted_input_formats():
+    detected = {
+        *OLE2_STREAM_FORMATS.values(),
+        *OOXML_CONTENT_TYPE_FORMATS.values(),
+        *ODF_MIMETYPE_FORMATS.values(),
+        *(file_format for _, file_format in MAGIC_FORMATS),
+        *TEXT_FORMATS,
+        *EXTENSION_FORMATS,
+        "bmp",
+        "webp",
+    }
+    # everything sniffed is converted to pdf, except what can't be
+    assert detected - OfficeDocumentConverter.input_formats == {"encrypted"}
+    assert OfficeDocumentConverter.input_formats >= {
+        *("bmp", "svg", "webp", "fodt", "fods", "vsdx", "wpd", "rtf", "pub"),
+    }
+    assert XLSToXLSXConverter.input_formats == {
+        *("xls", "xlsm", "xlsb", "xltx", "xltm", "ods", "csv", "tsv"),
+        *("fods", "sxc", "wk1", "wks", "wb2", "dbf", "slk", "dif"),
+    }
+
+
+@pytest.mark.no_deps
+def test_sniff_pdf_only_at_start(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"\xef\xbb\xbf\r\n%PDF-1.7\n")
+    assert sniff_format(path) == "pdf"
+
+    path.write_bytes(b"name,signature\nreport,%PDF-1.7\n")
+    assert sniff_format(path, "csv") == "csv"
+
+
+@pytest.mark.no_deps
+def test_sniff_plain_archive(tmp_path):
+    path = tmp_path / "file"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("report.docx", (FILES / "test-word.docx").read_bytes())
+    assert sniff_format(path) == "zip"
+
+
+@pytest.mark.no_deps
+def test_sniff_corrupt_files(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"")
+    assert sniff_format(path) is None
+
+    path.write_bytes(b"PK\x03\x04 truncated")
+    assert sniff_format(path) is None
+
+    path.write_bytes((FILES / "sample.xls").read_bytes()[:1024])
+    assert sniff_format(path) is None
+
+
+@pytest.mark.no_deps
+def test_origin_error_pages_are_not_converted(files_server):
+    response = client.post("/od_to_pdf/", json={"url": f"{files_server}/missing.docx"})
+    assert response.status_code == 500
+
+
+@pytest.mark.no_deps
+def test_pdf_input_is_passed_through(files_server):
+    response = client.post(
+        "/od_to_pdf/", json={"url": f"{files_server}/test-word.pdf?download"}
+    )
+    assert response.status_code == 200
+    assert response.content == (FILES / "test-word.pdf").read_bytes()
+
+
+@pytest.mark.no_deps
+def test_unsupported_inputs_are_rejected(files_server):
+    response = client.post("/od_to_pdf/", json={"url": f"{files_server}/test.html"})
+    assert response.status_code == 415
+
+    response = client.post(
+        "/xls_to_xlsx/", json={"url": f"{files_server}/test-word.docx"}
+    )
+    assert response.status_code == 415
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from processing_tools import main
+from processing_tools.warmup import WarmUp
+from processing_tools.workspace import ScratchSpace
+
+
+class StubWarmUp(WarmUp):
+    """
+    Warms up without the engines: libreoffice fails, the others take a moment.
+    """
+
+    async def _libreoffice(self) -> None:
+        raise RuntimeError("libreoffice is not installed")
+
+    async def _wkhtmltopdf(self) -> None:
+        await asyncio.sleep(0.1)
+
+    async def _browserless(self) -> None:
+        await asyncio.sleep(0.1)
+
+
+def stub_warm_up(tmp_path) -> StubWarmUp:
+    return StubWarmUp("tests/files", ScratchSpace(tmp_path, "", 0, 0), [], 30)
+
+
+@pytest.mark.no_deps
+async def test_warm_up_reports_engine_states(tmp_path):
+    warm_up = stub_warm_up(tmp_path)
+    assert not warm_up.done
+
+    await warm_up.run()
+    assert warm_up.done
+    assert warm_up.engines == {
+        "libreoffice": "failed",
+        "wkhtmltopdf": "ok",
+        "browserless": "ok",
+    }
+
+
+async def test_warm_up_reports_every_engine(tmp_path):
+    warm_up = WarmUp(
+        "tests/files",
+        ScratchSpace(tmp_path, "", 0, 0),
+        # nothing listens on the discard port
+        ["http://127.0.0.1:9"],
+        timeout=30,
+    )
+    assert not warm_up.done
+
+    await warm_up.run()
+    assert warm_up.done
+    assert warm_up.engines == {
+        "libreoffice": "ok",
+        "wkhtmltopdf": "ok",
+        "browserless": "failed",
+    }
+    # the samples and their outputs are cleaned up
+    assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+
+@pytest.mark.no_deps
+def test_ready_after_warm_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.settings, "warmup_enabled", True)
+    monkeypatch.setattr(main, "warm_up", stub_warm_up(tmp_path))
+    assert TestClient(main.app).get("/ready").status_code == 503
+
+    with TestClient(main.app) as client:
+        for _ in range(300):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+        assert response.status_code == 200
+        assert response.json()["ready"]
+        assert response.json()["engines"]["libreoffice"] == "failed"
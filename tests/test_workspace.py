@@ -0,0 +1,131 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+from processing_tools.office import OfficeDocumentConverter
+from processing_tools.spreadsheet import XLSToXLSXConverter
+from processing_tools.utils import save_download
+from processing_tools.workspace import (
+    ScratchSpace,
+    job_input_path,
+    new_job_id,
+    remove_job_files,
+    remove_orphaned_files,
+)
+
+
+@pytest.mark.no_deps
+def test_output_path_does_not_collide_with_input(tmp_path):
+    in_path = job_input_path(tmp_path, new_job_id(), "xlsx")
+    out_path = XLSToXLSXConverter(None).output_path(in_path)
+
+    assert out_path != in_path
+    assert out_path.suffix == ".xlsx"
+    assert out_path.stem == in_path.stem
+
+
+@pytest.mark.no_deps
+def test_jobs_sharing_a_work_dir_get_distinct_outputs(tmp_path):
+    converter = OfficeDocumentConverter(None)
+    first = converter.output_path(job_input_path(tmp_path, new_job_id(), "docx"))
+    second = converter.output_path(job_input_path(tmp_path, new_job_id(), "docx"))
+
+    assert first != second
+    assert first.parent == second.parent == tmp_path / "pdf"
+
+
+@pytest.mark.no_deps
+def test_remove_orphaned_files(tmp_path):
+    (tmp_path / "pdf").mkdir()
+    old = tmp_path / "pdf" / "old.pdf"
+    new = tmp_path / "new.docx"
+    old.write_bytes(b"old")
+    new.write_bytes(b"new")
+    an_hour_ago = time.time() - 60 * 60
+    os.utime(old, (an_hour_ago, an_hour_ago))
+
+    assert remove_orphaned_files(tmp_path, max_age=60) == 1
+    assert not old.exists()
+    assert new.exists()
+
+    remove_job_files(new, Path(tmp_path / "never-written.pdf"), None)
+    assert not new.exists()
+
+
+@pytest.mark.no_deps
+def test_scratch_space_spills_to_disk_when_over_budget(tmp_path):
+    (tmp_path / "shm").mkdir()
+    scratch_space = ScratchSpace(
+        tmp_path / "disk",
+        tmp_path / "shm" / "processing_tools",
+        memory_max_file_bytes=100,
+        memory_budget_bytes=300,
+    )
+
+    first = scratch_space.reserve(100)
+    second = scratch_space.reserve(100)
+    too_big = scratch_space.reserve(101)
+    unknown = scratch_space.reserve(None)
+
+    assert first.medium == "memory"
+    assert first.dir == tmp_path / "shm" / "processing_tools"
+    assert first.dir.is_dir()
+    assert second.medium == "disk"
+    assert too_big.medium == "disk"
+    assert unknown.medium == "disk"
+
+    first.release()
+    first.release()
+    assert scratch_space.memory_bytes == 0
+    with scratch_space.reserve(100) as third:
+        assert third.medium == "memory"
+    assert scratch_space.memory_bytes == 0
+
+
+@pytest.mark.no_deps
+def test_scratch_space_without_memory_dir(tmp_path):
+    scratch_space = ScratchSpace(
+        tmp_path, tmp_path / "missing" / "processing_tools", 100, 300
+    )
+
+    assert scratch_space.roots == [tmp_path]
+    assert scratch_space.reserve(1).medium == "disk"
+
+
+class FakeDownload(requests.Response):
+    def __init__(self, body: bytes):
+        super().__init__()
+        self.body = body
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+
+@pytest.mark.no_deps
+def test_download_larger_than_announced_spills_to_disk(tmp_path):
+    (tmp_path / "shm").mkdir()
+    scratch_space = ScratchSpace(tmp_path / "disk", tmp_path / "shm" / "pt", 100, 300)
+
+    # e.g. a gzipped body whose Content-Length is the compressed size
+    scratch = scratch_space.reserve(10)
+    assert scratch.medium == "memory"
+    in_path = job_input_path(scratch.dir, new_job_id(), "docx")
+    path = save_download(FakeDownload(b"x" * 50), in_path, 8, scratch)
+    assert path == in_path
+    assert scratch.medium == "memory"
+    assert scratch_space.memory_bytes == 100
+
+    path = save_download(FakeDownload(b"x" * 150), in_path, 8, scratch)
+    assert scratch.medium == "disk"
+    assert path == tmp_path / "disk" / in_path.name
+    assert path.read_bytes() == b"x" * 150
+    assert not in_path.exists()
+    assert scratch_space.memory_bytes == 0
+    assert scratch_space.disk_bytes == 300
+
+    scratch.release()
+    assert scratch_space.disk_bytes == 0